@@ -1,133 +1,96 @@
 import pandas as pd
-import numpy as np
 import dash
 from dash import dcc, html
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, State
 import plotly.express as px
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
-import requests
-import json
+
+from aligned_join import aligned_join, coverage_summary
+from clientside_graph import R_PLACEHOLDER, graph_data, register_year_filter, static_graph
+from cso_cache import CACHE
+from correlation import CorrelationIndex
+from cso_client import CLIENT
+from cso_store import load_tables
+from discovery import top_correlations, wide_series
+from figure_cache import FigureCache
+from metrics import CallbackMetric, Gauge, add_metrics_route, timed
+from parse_response import DEFAULT_FETCH_WORKERS, get_cso_data, memory_summary
+from periods import to_annual
+from snapshot_loader import SnapshotLoader
 
 # Initialize the Dash app
 app = dash.Dash(__name__, title="Spurious Ireland: Correlation ≠ Causation")
 
+# Filter by year range in the browser: the server only sends each pair's full series
+# when the selection or the data changes, instead of on every slider movement
+CLIENTSIDE_FILTERING = True
+
+# Years shown on the dashboard
+FIRST_YEAR, LAST_YEAR = 2010, 2023
+YEARS = [str(year) for year in range(FIRST_YEAR, LAST_YEAR + 1)]
+
+# CSO tables used by the dashboard: name -> (table id, variables)
+# The variables are sent to the CSO so only the cells the charts need are downloaded
+CSO_TABLES = {
+    'potato': ("AQA04", {"Type of Crop": ["Potatoes"], "Statistic": ["Crop Production"], "Year": YEARS}),
+    'migration': ("PEA15", {"Component": ["Net migration"], "Year": YEARS}),
+}
+
+# CSO tables searched for spurious correlations, every series of each; name -> (table id, variables)
+DISCOVERY_TABLES = {
+    'Crops': ("AQA04", {"Year": YEARS}),
+    'Population': ("PEA15", {"Year": YEARS}),
+}
+# Number of discovered pairs added to the correlation selector
+DISCOVERED_PAIRS = 10
+
 
-def parse_reponse(dimensions, values):
-    dimension_compiled = {}
-    for d in dimensions.keys():
-        # dimension_compiled.append([])
-        # print(dimensions[d]['category']['label'])
-        tmparray = []
-        for lst in dimensions[d]['category']['label'].keys():
-            tmparray.append(dimensions[d]['category']['label'][lst])
-        dimension_compiled[d] = tmparray
-
-    n = 0
-    lst2 = [[""]]
-    while n < len(dimension_compiled):
-        lst2.append([])
-        for d in dimension_compiled[list(dimension_compiled.keys())[n]]:
-            for l in lst2[n]:
-                lst2[n + 1].append(l + "_" + d)
-        n = n + 1
-
-    m = 0
-    data_dict = []
-    for l in lst2[len(lst2) - 1]:
-        tmpd = {}
-        f = l.split("_")
-        r = 1
-        for lbl in list(dimension_compiled.keys()):
-            tmpd[lbl] = f[r]
-            r = r + 1
-        tmpd["value"] = values[m]
-        data_dict.append(tmpd)
-        m = m + 1
-    return data_dict
-
-
-
-# Function to fetch data from CSO API
-def get_cso_data(table_id, variables=None):
+def to_annual_series(data, name, how='mean'):
     """
-    Fetch data from CSO PxStat API
-    
+    Reduce a CSO table filtered down to a single series to Year + value columns
+
     Args:
-        table_id: The ID of the table to fetch
-        variables: Dictionary of variables to filter by
-    
+        data: DataFrame from get_cso_data with one time dimension
+        name: Name of the value column
+        how: How quarterly or monthly values make a year, see periods.resample
+
     Returns:
-        pandas DataFrame with the results
+        pandas DataFrame with 'Year' and name columns
     """
-    url = f"https://ws.cso.ie/public/api.restful/PxStat.Data.Cube_API.ReadDataset/{table_id}/JSON-stat/2.0/en"
-    
-    # If variables are specified, add them to the request
-    if variables:
-        params = {
-            "query": json.dumps({"request": variables}),
-            "format": "json-stat2"
-        }
-        response = requests.get(url, params=params)
-    else:
-        response = requests.get(url)
-    
-    if response.status_code == 200:
-        data = response.json()
-        
-        # Process JSON-stat format to pandas DataFrame
-        # This part depends on the structure of the response
-        # Example basic processing:
-        dimensions = data['dimension']
-        values = data['value']
-        
-        # Create a DataFrame based on the specific structure
-        # This is a simplified example - you'll need to adapt it
-        results = parse_reponse(dimensions, values)
-
-        
-        # Process based on the specific structure of the dataset
-        # More processing code would go here
-        
-        return pd.DataFrame(results)
-    else:
-        print(f"Error fetching data: {response.status_code}")
-        return pd.DataFrame()
+    if data.empty:
+        return pd.DataFrame({'Year': pd.Series(dtype=int), name: pd.Series(dtype=float)})
+    data = to_annual(data, how)
+    time_column = next(c for c in data.columns if c.startswith('TLIST'))
+    return pd.DataFrame({'Year': data[time_column].astype(int), name: data['value'].to_numpy()})
 
 # Function to get potato yield data
-def get_potato_data():
+def get_potato_data(data=None):
     """
     Get potato yield data from CSO
-    For this example, I'm using a sample - replace with actual API call
-    
+
     Table code for crops: AQA04 (Crop Yield and Production)
+
+    Args:
+        data: Already loaded table, e.g. from load_tables
     """
-    # In reality, you would do:
-    data = get_cso_data("AWA04")
-    
-    #data = get_cso_data("AQA04", {"TYPE OF CROP": ["Potatoes"], "Statistic": ["Crop Production (000 Tonnes)"], 
-    #                              "Year": ["2010", "2011", "2012", "2013", "2014", "2015", "2016", "2017", "2018", "2019", "2020", "2021", "2022", "2023"]})
-    # Returning sample data for now
-    #years = list(range(2010, 2024))
-    #data = {
-    #    'Year': years,
-    #    'Potato_Yield_Tonnes_per_Hectare': [32, 33, 30, 28, 35, 37, 31, 33, 29, 31, 36, 34, 32, 35]
-    #}
-    return pd.DataFrame(data)
+    if data is None:
+        data = get_cso_data(*CSO_TABLES['potato'])
+    return to_annual_series(data, 'Potato_Yield_Tonnes_per_Hectare')
 
 # Function to get migration data
-def get_migration_data():
+def get_migration_data(data=None):
     """
     Get migration data from CSO
     
     Table code for migration: PEA15 (Population and Migration Estimates)
+
+    Args:
+        data: Already loaded table, e.g. from load_tables
     """
-    # In reality, you would do:
-    # df = get_cso_data("PEA15", {"STATISTIC": ["Immigration", "Emigration"]})
-    data = get_cso_data("PEA15")
-    # Then calculate net migration as Immigration - Emigration
-    # Returning sample data for now
-    return pd.DataFrame(data)
+    if data is None:
+        data = get_cso_data(*CSO_TABLES['migration'])
+    return to_annual_series(data, 'Net_Migration_Thousands')
 
 # Function to get marriages data
 def get_marriages_data():
@@ -155,7 +118,8 @@ def get_gdp_data():
     """
     # In reality, you would do:
     # df = get_cso_data("NQQ28", {"Statistic": ["Percentage Change Over Previous Period"]})
-    # Then aggregate quarterly data to annual
+    # Then compound the quarterly changes to annual:
+    # return to_annual_series(df, 'GDP_Growth_Rate', how='compound')
     # Returning sample data for now
     years = list(range(2010, 2024))
     data = {
@@ -164,26 +128,95 @@ def get_gdp_data():
     }
     return pd.DataFrame(data)
 
+# Fetch the indicators, each a Year column and its own value column
+def get_indicators(tables):
+    return [
+        get_potato_data(tables['potato']),
+        get_migration_data(tables['migration']),
+        get_marriages_data(),
+        get_gdp_data(),
+    ]
+
 # Fetch and merge data
-def get_merged_data():
-    potato_df = get_potato_data()
-    migration_df = get_migration_data()
-    marriages_df = get_marriages_data()
-    gdp_df = get_gdp_data()
-    
-    # Merge all datasets on Year
-    merged_df = potato_df.merge(migration_df, on='Year', how='outer')
-    merged_df = merged_df.merge(marriages_df, on='Year', how='outer')
-    merged_df = merged_df.merge(gdp_df, on='Year', how='outer')
-    
-    return merged_df
+def get_merged_data(max_workers=DEFAULT_FETCH_WORKERS, offline=False, tables=None):
+    # Map the tables from the local store, downloading any missing or
+    # out-of-date ones at once rather than one after another
+    if tables is None:
+        tables = load_tables(CSO_TABLES, max_workers=max_workers, offline=offline)
 
-# Fetch all data
-df = get_merged_data()
+    # Align all datasets on Year in one pass
+    with timed('merge'):
+        return aligned_join(get_indicators(tables))
 
-# Calculate correlation coefficients
-corr_potato_migration = round(np.corrcoef(df['Potato_Yield_Tonnes_per_Hectare'], df['Net_Migration_Thousands'])[0, 1], 2)
-corr_marriages_gdp = round(np.corrcoef(df['Marriages'], df['GDP_Growth_Rate'])[0, 1], 2)
+# Series compared by each hand-picked option of the correlation selector
+CORRELATION_PAIRS = {
+    'potato_migration': ('Potato_Yield_Tonnes_per_Hectare', 'Net_Migration_Thousands'),
+    'marriages_gdp': ('Marriages', 'GDP_Growth_Rate'),
+}
+CORRELATION_OPTIONS = [
+    {'label': 'Potato Yield vs. Net Migration', 'value': 'potato_migration'},
+    {'label': 'Marriages vs. GDP Growth Rate', 'value': 'marriages_gdp'}
+]
+
+def discover_pairs(tables):
+    """
+    Find the most correlated pairs of series across the discovery tables
+
+    Args:
+        tables: Dictionary of name -> DataFrame holding every table in DISCOVERY_TABLES
+
+    Returns:
+        (DataFrame of every series by Year, pairs as selector value -> (x, y), selector options)
+    """
+    wide = [wide_series(tables[name], name) for name in DISCOVERY_TABLES]
+    series = pd.concat(wide, axis=1).sort_index()
+    # Series of the same table are usually related for real, so only pairs across tables count
+    groups = [name for name, frame in zip(DISCOVERY_TABLES, wide) for _ in frame.columns]
+    found = top_correlations(series, k=DISCOVERED_PAIRS, groups=groups)
+
+    pairs, options = {}, []
+    for x, y, r in zip(found['x'], found['y'], found['r']):
+        value = f"{x} | {y}"
+        pairs[value] = (x, y)
+        options.append({'label': f"{x} vs. {y} (r = {r:.2f})", 'value': value})
+    return series.rename_axis('Year'), pairs, options
+
+def load_snapshot(offline=False):
+    tables = load_tables(dict(CSO_TABLES, **DISCOVERY_TABLES), offline=offline)
+    with timed('discovery'):
+        series_df, discovered, options = discover_pairs(tables)
+    with timed('merge'):
+        merged_df = aligned_join(get_indicators(tables) + [series_df])
+    SNAPSHOT_BYTES.set(int(merged_df.memory_usage(deep=True).sum()))
+    pairs = dict(CORRELATION_PAIRS, **discovered)
+    if not offline:
+        print(coverage_summary(merged_df))
+        print(memory_summary(tables.values()))
+        print(CACHE.summary())
+        print(CLIENT.summary())
+        print(figure_cache.summary())
+    # Running sums behind the correlation for any year range
+    return {
+        'df': merged_df,
+        'pairs': pairs,
+        'options': CORRELATION_OPTIONS + options,
+        'correlations': CorrelationIndex(merged_df, pairs),
+    }
+
+# Rendered graphs per selection (and year range when filtering on the server), dropped whenever a new snapshot arrives
+figure_cache = FigureCache()
+
+# Per-stage timings, counters and memory on /metrics for Prometheus
+SNAPSHOT_BYTES = Gauge('dashboard_snapshot_bytes', "Memory held by the dashboard's current data snapshot")
+CallbackMetric('dashboard_figure_cache_events_total', "Lookups in the rendered graph cache, by outcome", 'counter',
+               lambda: {(('event', event),): count for event, count in figure_cache.stats.items()})
+CallbackMetric('dashboard_snapshot_version', "Number of data snapshots loaded since start", 'gauge',
+               lambda: {(): data_loader.version})
+add_metrics_route(app.server)
+
+# Load data in the background so the app starts without waiting for the CSO:
+# the last stored snapshot first, then a refreshed one
+data_loader = SnapshotLoader(load_snapshot, lambda: load_snapshot(offline=True)).start()
 
 # App layout
 app.layout = html.Div([
@@ -199,10 +232,7 @@ app.layout = html.Div([
             html.H3("Select a Spurious Correlation:"),
             dcc.Dropdown(
                 id='correlation-selector',
-                options=[
-                    {'label': 'Potato Yield vs. Net Migration', 'value': 'potato_migration'},
-                    {'label': 'Marriages vs. GDP Growth Rate', 'value': 'marriages_gdp'}
-                ],
+                options=CORRELATION_OPTIONS,
                 value='potato_migration',
                 style={'width': '100%'}
             ),
@@ -212,10 +242,10 @@ app.layout = html.Div([
             html.H3("Time Period:"),
             dcc.RangeSlider(
                 id='year-slider',
-                min=min(df['Year']),
-                max=max(df['Year']),
-                value=[min(df['Year']), max(df['Year'])],
-                marks={year: str(year) for year in range(min(df['Year']), max(df['Year'])+1, 2)},
+                min=FIRST_YEAR,
+                max=LAST_YEAR,
+                value=[FIRST_YEAR, LAST_YEAR],
+                marks={year: str(year) for year in range(FIRST_YEAR, LAST_YEAR+1, 2)},
                 step=1
             )
         ], style={'width': '65%', 'display': 'inline-block', 'verticalAlign': 'top'})
@@ -224,6 +254,12 @@ app.layout = html.Div([
     html.Div([
         dcc.Graph(id='correlation-graph')
     ]),
+
+    # Polls the background loader so new data reaches the page without a reload
+    dcc.Interval(id='data-refresh', interval=5 * 1000),
+    dcc.Store(id='data-version'),
+    # Full series of the selected pair, filtered by year in the browser
+    dcc.Store(id='graph-data'),
     
     html.Div(id='explanation-text', 
              style={'margin': '20px', 'padding': '15px', 'backgroundColor': '#F0FFF0', 'borderRadius': '10px'}),
@@ -249,14 +285,84 @@ app.layout = html.Div([
 
 # Callbacks
 @app.callback(
-    [Output('correlation-graph', 'figure'),
-     Output('explanation-text', 'children')],
-    [Input('correlation-selector', 'value'),
-     Input('year-slider', 'value')]
+    Output('data-version', 'data'),
+    [Input('data-refresh', 'n_intervals')],
+    [State('data-version', 'data')]
 )
-def update_graph(selected_correlation, year_range):
-    filtered_df = df[(df['Year'] >= year_range[0]) & (df['Year'] <= year_range[1])]
-    
+def check_data_version(n_intervals, current_version):
+    _, version = data_loader.get()
+    return dash.no_update if version == current_version else version
+
+
+@app.callback(
+    [Output('correlation-selector', 'options'),
+     Output('correlation-selector', 'value')],
+    [Input('data-version', 'data')],
+    [State('correlation-selector', 'value')]
+)
+def update_options(data_version, selected_correlation):
+    """Offer the pairs discovered in the current snapshot, keeping the selection if it's still there"""
+    snapshot, _ = data_loader.get()
+    if snapshot is None:
+        return dash.no_update, dash.no_update
+    if selected_correlation in snapshot['pairs']:
+        return snapshot['options'], dash.no_update
+    return snapshot['options'], 'potato_migration'
+
+
+def loading_graph():
+    fig = go.Figure()
+    fig.update_layout(
+        annotations=[dict(text="Loading data from the CSO...", showarrow=False, font=dict(size=20))],
+        xaxis=dict(visible=False),
+        yaxis=dict(visible=False),
+        plot_bgcolor='white',
+        height=600
+    )
+    explanation = html.Div([
+        html.H3("Fetching the latest figures...", style={'textAlign': 'center', 'color': '#4B0082'})
+    ])
+    return fig, explanation
+
+
+def build_discovered_graph(filtered_df, x, y, filtered_corr):
+    fig = make_subplots(specs=[[{"secondary_y": True}]])
+    fig.add_trace(
+        go.Scatter(x=filtered_df['Year'], y=filtered_df[x], name=x, line=dict(color='#8B4513', width=3)),
+        secondary_y=False
+    )
+    fig.add_trace(
+        go.Scatter(x=filtered_df['Year'], y=filtered_df[y], name=y, line=dict(color='#2E8B57', width=3)),
+        secondary_y=True
+    )
+    fig.update_layout(
+        title='A Relationship Found by Searching the CSO',
+        xaxis_title='Year',
+        legend=dict(orientation='h', yanchor='bottom', y=1.02, xanchor='center', x=0.5),
+        hovermode='x',
+        plot_bgcolor='white',
+        height=600
+    )
+    fig.update_yaxes(title_text=x, secondary_y=False)
+    fig.update_yaxes(title_text=y, secondary_y=True)
+
+    explanation = html.Div([
+        html.H3(f"{x} & {y}: r = {filtered_corr}", style={'textAlign': 'center', 'color': '#4B0082'}),
+        html.P([
+            "Out of every pair of series searched, these two move together most closely, with a correlation coefficient ",
+            f"of {filtered_corr}. Search enough series and some will always line up by chance."
+        ]),
+        html.P([
+            "Nobody chose this pair because the two are connected: it was picked purely because the numbers happen to match."
+        ], style={'fontStyle': 'italic'})
+    ])
+    return fig, explanation
+
+
+def build_graph(filtered_df, selected_correlation, filtered_corr, pairs=CORRELATION_PAIRS):
+    if selected_correlation not in CORRELATION_PAIRS:
+        return build_discovered_graph(filtered_df, *pairs[selected_correlation], filtered_corr)
+
     if selected_correlation == 'potato_migration':
         # Create subplot with two y-axes
         fig = make_subplots(specs=[[{"secondary_y": True}]])
@@ -297,9 +403,6 @@ def update_graph(selected_correlation, year_range):
         fig.update_yaxes(title_text="Potato Yield (tonnes/hectare)", secondary_y=False)
         fig.update_yaxes(title_text="Net Migration (thousands)", secondary_y=True)
         
-        # Calculate updated correlation
-        filtered_corr = round(np.corrcoef(filtered_df['Potato_Yield_Tonnes_per_Hectare'], filtered_df['Net_Migration_Thousands'])[0, 1], 2)
-        
         explanation = html.Div([
             html.H3(f"Potato Yields & Migration: r = {filtered_corr}", style={'textAlign': 'center', 'color': '#4B0082'}),
             html.P([
@@ -354,9 +457,6 @@ def update_graph(selected_correlation, year_range):
         fig.update_yaxes(title_text="Number of Marriages", secondary_y=False)
         fig.update_yaxes(title_text="GDP Growth Rate (%)", secondary_y=True)
         
-        # Calculate updated correlation
-        filtered_corr = round(np.corrcoef(filtered_df['Marriages'], filtered_df['GDP_Growth_Rate'])[0, 1], 2)
-        
         explanation = html.Div([
             html.H3(f"Marriages & GDP Growth: r = {filtered_corr}", style={'textAlign': 'center', 'color': '#4B0082'}),
             html.P([
@@ -374,5 +474,52 @@ def update_graph(selected_correlation, year_range):
     return fig, explanation
 
 
+def update_graph(selected_correlation, year_range, data_version=None):
+    snapshot, version = data_loader.get()
+    if snapshot is None or selected_correlation not in snapshot['pairs']:
+        return loading_graph()
+
+    def build():
+        df, correlations = snapshot['df'], snapshot['correlations']
+        filtered_df = df[(df['Year'] >= year_range[0]) & (df['Year'] <= year_range[1])]
+        filtered_corr = round(correlations.corr(selected_correlation, *year_range), 2)
+        with timed('figure'):
+            return build_graph(filtered_df, selected_correlation, filtered_corr, snapshot['pairs'])
+
+    # Keyed on the loader's version rather than data_version so a page that hasn't polled yet still gets current data
+    return figure_cache.get((selected_correlation, tuple(year_range)), version, build)
+
+
+def update_graph_data(selected_correlation, data_version=None):
+    snapshot, version = data_loader.get()
+    if snapshot is None or selected_correlation not in snapshot['pairs']:
+        return static_graph(*loading_graph())
+
+    def build():
+        df, pairs = snapshot['df'], snapshot['pairs']
+        with timed('figure'):
+            return (graph_data(*build_graph(df, selected_correlation, R_PLACEHOLDER, pairs), df,
+                               pairs[selected_correlation]),)
+
+    return figure_cache.get((selected_correlation,), version, build)[0]
+
+
+if CLIENTSIDE_FILTERING:
+    app.callback(
+        Output('graph-data', 'data'),
+        [Input('correlation-selector', 'value'),
+         Input('data-version', 'data')]
+    )(update_graph_data)
+    register_year_filter(app)
+else:
+    app.callback(
+        [Output('correlation-graph', 'figure'),
+         Output('explanation-text', 'children')],
+        [Input('correlation-selector', 'value'),
+         Input('year-slider', 'value'),
+         Input('data-version', 'data')]
+    )(update_graph)
+
+
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
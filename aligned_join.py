@@ -0,0 +1,134 @@
+import numpy as np
+import pandas as pd
+
+
+def period_codes(values):
+    """
+    Integer period codes for join keys, whatever dtype they arrived in
+
+    Args:
+        values: Array-like of years as ints, integral floats or strings like '2010'
+
+    Returns:
+        numpy int64 array
+
+    Raises:
+        ValueError if a key is missing or not a whole number
+    """
+    if isinstance(getattr(values, 'dtype', None), np.dtype) and values.dtype.kind in 'iu':
+        return np.asarray(values, dtype=np.int64)
+    values = pd.Series(values)
+    if not pd.api.types.is_numeric_dtype(values):
+        try:
+            values = pd.to_numeric(values.astype(str).str.strip())
+        except ValueError as e:
+            raise ValueError(f"Join keys must be whole numbers: {e}") from None
+    keys = values.to_numpy(dtype=np.float64, na_value=np.nan)
+    if np.isnan(keys).any():
+        raise ValueError("Join keys can't be missing")
+    codes = keys.astype(np.int64)
+    if (codes != keys).any():
+        raise ValueError(f"Join keys must be whole numbers, got {keys[codes != keys][0]}")
+    return codes
+
+
+def _keys_and_columns(frame, on):
+    if on in frame.columns:
+        return frame[on], [name for name in frame.columns if name != on]
+    if frame.index.name == on:
+        return frame.index, list(frame.columns)
+    raise ValueError(f"Frame has neither a {on!r} column nor index")
+
+
+def aligned_join(frames, on='Year'):
+    """
+    Outer join of frames on a period key in one pass
+
+    Each frame's keys become int64 period codes, the union of them is sorted
+    once and every frame's rows are scattered into one preallocated float64
+    block at their position in it, instead of merging frame by frame and
+    rehashing and copying everything gathered so far each time. Non-numeric
+    columns get a column of their own.
+
+    Args:
+        frames: DataFrames with on as a column or as the index, at most one row per key
+        on: Name of the key
+
+    Returns:
+        pandas DataFrame with on (int64, ascending) and every other column of
+        frames in order; NaN where a frame has no row for a key
+
+    Raises:
+        ValueError if a frame repeats a key or two frames share a column name
+    """
+    frames = list(frames)
+    parts = [_keys_and_columns(frame, on) for frame in frames]
+    codes = [period_codes(keys) for keys, _ in parts]
+    names = [name for _, columns in parts for name in columns]
+    seen = set()
+    for name in names:
+        if name in seen:
+            raise ValueError(f"Column {name!r} is in more than one frame")
+        seen.add(name)
+
+    index = np.unique(np.concatenate(codes)) if codes else np.empty(0, dtype=np.int64)
+    block = np.full((len(index), len(names)), np.nan)
+    others = {}
+    start = 0
+    for frame, (_, columns), frame_codes in zip(frames, parts, codes):
+        if len(np.unique(frame_codes)) != len(frame_codes):
+            raise ValueError(f"{on} repeats in the frame with columns {columns}")
+        rows = np.searchsorted(index, frame_codes)
+        for offset, name in enumerate(columns):
+            column = frame[name]
+            if pd.api.types.is_numeric_dtype(column) and not pd.api.types.is_bool_dtype(column):
+                block[rows, start + offset] = column.to_numpy(dtype=np.float64, na_value=np.nan)
+            else:
+                values = np.full(len(index), None, dtype=object)
+                values[rows] = column.to_numpy(dtype=object)
+                others[name] = values
+        start += len(columns)
+
+    merged = pd.DataFrame(block, columns=names, copy=False)
+    for name, values in others.items():
+        merged[name] = values
+    merged.insert(0, on, index)
+    return merged
+
+
+def coverage(frame, on='Year'):
+    """
+    How much of the joined range each column fills
+
+    Returns:
+        pandas DataFrame indexed by column with the first and last key it has
+        a value for, the count of values and of NaNs, and the filled fraction
+    """
+    keys = frame[on].to_numpy()
+    values = frame.drop(columns=on)
+    present = values.notna().to_numpy()
+    count = present.sum(axis=0)
+    has = count > 0
+    first = pd.Series(pd.NA, index=values.columns, dtype='Int64')
+    last = first.copy()
+    if len(keys):
+        first[has] = keys[present.argmax(axis=0)][has]
+        last[has] = keys[len(keys) - 1 - present[::-1].argmax(axis=0)][has]
+    return pd.DataFrame({
+        'first': first,
+        'last': last,
+        'values': count,
+        'nans': len(keys) - count,
+        'coverage': count / max(len(keys), 1),
+    }, index=values.columns)
+
+
+def coverage_summary(frame, on='Year'):
+    """One line for the logs: size of the joined range and how much of it is filled"""
+    report = coverage(frame, on)
+    if report.empty or frame.empty:
+        return f"Joined {len(report)} series over no {on.lower()}s"
+    keys = frame[on]
+    return (f"Joined {len(report)} series over {len(frame)} {on.lower()}s ({keys.iloc[0]}-{keys.iloc[-1]}): "
+            f"{report['coverage'].mean():.0%} of cells filled, {(report['values'] == 0).sum()} series empty, "
+            f"{report['nans'].sum()} NaNs")
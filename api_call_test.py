@@ -1,6 +1,7 @@
 import urllib.request, json
 import pandas as pd
-with urllib.request.urlopen("https://ws.cso.ie/public/api.restful/PxStat.Data.Cube_API.ReadDataset/PEA15/JSON-stat/2.0/en") as url:
+from cso_client import CSO_API_BASE
+with urllib.request.urlopen(CSO_API_BASE + "/public/api.restful/PxStat.Data.Cube_API.ReadDataset/PEA15/JSON-stat/2.0/en") as url:
     data = json.load(url)
 print(data)
 
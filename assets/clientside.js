@@ -0,0 +1,74 @@
+// Year-range filtering for the correlation dashboards, so moving the slider
+// never calls the server. The data comes from graph_data in clientside_graph.py.
+
+// Pearson r of the points where both series have a value, NaN if fewer than two
+function pearson(x, y) {
+    var xs = [], ys = [];
+    for (var i = 0; i < x.length; i++) {
+        if (x[i] !== null && y[i] !== null) {
+            xs.push(x[i]);
+            ys.push(y[i]);
+        }
+    }
+    var n = xs.length;
+    if (n < 2) {
+        return NaN;
+    }
+    var mx = 0, my = 0;
+    for (var j = 0; j < n; j++) {
+        mx += xs[j] / n;
+        my += ys[j] / n;
+    }
+    var sxy = 0, sxx = 0, syy = 0;
+    for (var k = 0; k < n; k++) {
+        sxy += (xs[k] - mx) * (ys[k] - my);
+        sxx += (xs[k] - mx) * (xs[k] - mx);
+        syy += (ys[k] - my) * (ys[k] - my);
+    }
+    if (sxx <= 0 || syy <= 0) {
+        return NaN;
+    }
+    return Math.max(-1, Math.min(1, sxy / Math.sqrt(sxx * syy)));
+}
+
+// Same text as Python's str(round(r, 2))
+function formatR(r) {
+    if (isNaN(r)) {
+        return 'nan';
+    }
+    var rounded = Math.round(r * 100) / 100;
+    return Number.isInteger(rounded) ? rounded.toFixed(1) : String(rounded);
+}
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    spurious: {
+        filter_graph: function(data, yearRange) {
+            if (!data) {
+                return [window.dash_clientside.no_update, window.dash_clientside.no_update];
+            }
+            var keep = [];
+            data.axis.forEach(function(value, i) {
+                if (value >= yearRange[0] && value <= yearRange[1]) {
+                    keep.push(i);
+                }
+            });
+            function pick(values) {
+                return keep.map(function(i) { return values[i]; });
+            }
+
+            var axis = pick(data.axis);
+            var series = data.series.map(pick);
+            var figure = Object.assign({}, data.figure);
+            figure.data = data.figure.data.map(function(trace, i) {
+                if (i >= series.length) {
+                    return trace;
+                }
+                return Object.assign({}, trace, {x: axis, y: series[i]});
+            });
+
+            var r = series.length === 2 ? formatR(pearson(series[0], series[1])) : 'nan';
+            var explanation = JSON.parse(JSON.stringify(data.explanation).split(data.placeholder).join(r));
+            return [figure, explanation];
+        }
+    }
+});
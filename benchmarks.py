@@ -0,0 +1,224 @@
+"""
+Benchmarks for the ingestion, merge and callback hot paths
+
+Times parse_reponse on synthetic JSON-stat cubes of increasing size and
+dimensionality, get_cso_data against a local PxStat stand-in, and
+get_merged_data, update_graph and update_graph_data of API_call_inc.py for
+every selection and a few year ranges. Nothing talks to ws.cso.ie.
+
+Each run is saved to the results directory and compared with the previous
+one (or --baseline); timings that got slower by more than the threshold
+are flagged and the exit status is 1.
+
+Run as a script: python benchmarks.py [--repeat N] [--sizes small,medium]
+"""
+import atexit
+import os
+import shutil
+import tempfile
+
+# Keep the benchmark's cache, store and catalog away from the real ones; this
+# has to happen before the CSO modules read their settings on import
+_SCRATCH = tempfile.mkdtemp(prefix='cso-bench-')
+atexit.register(shutil.rmtree, _SCRATCH, ignore_errors=True)
+os.environ['CSO_CACHE_DIR'] = os.path.join(_SCRATCH, 'cache')
+os.environ['CSO_STORE_DIR'] = os.path.join(_SCRATCH, 'store')
+os.environ['CSO_CATALOG_PATH'] = os.path.join(_SCRATCH, 'catalog.json')
+
+import argparse
+import glob
+import json
+import platform
+import statistics
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from figure_cache import FigureCache
+from parse_response import fetch_cso_tables, get_cso_data, parse_reponse
+from pxstat_server import PxStatServer, synthetic_cube
+
+# Where each run's timings are saved
+DEFAULT_RESULTS_DIR = os.environ.get(
+    'CSO_BENCH_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.bench_results'))
+DEFAULT_REPEAT = 5
+# Relative slowdown of the median flagged as a regression
+DEFAULT_THRESHOLD = 0.2
+# Slowdowns smaller than this many seconds are noise, whatever the ratio
+NOISE_FLOOR = 0.001
+# Synthetic cubes: name -> categories per dimension (statistic, year, classifications...)
+CUBE_SIZES = {
+    'small': (2, 20, 10),
+    'medium': (3, 30, 40, 25),
+    'large': (4, 35, 30, 25, 10),
+}
+
+
+def timed(fn, repeat):
+    """
+    Call fn repeat times
+
+    Returns:
+        Dictionary of the min and median wall time in seconds
+    """
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        seconds.append(time.perf_counter() - start)
+    return {'min': min(seconds), 'median': statistics.median(seconds), 'repeat': repeat}
+
+
+def _relabel(cube, d, label, labels):
+    """Give a synthetic dimension the label and category labels of a real one"""
+    category = cube['dimension'][d]['category']
+    cube['dimension'][d]['label'] = label
+    category['label'] = dict(zip(category['index'], labels))
+
+
+def dashboard_cubes():
+    """
+    Synthetic AQA04 and PEA15 with the dimensions and categories API_call_inc.py selects
+    """
+    crops = synthetic_cube('AQA04', (2, 25, 4), seed=1, first_year=2000)
+    _relabel(crops, 'STATISTIC', 'Statistic', ['Crop Production', 'Crop Yield'])
+    _relabel(crops, 'C01', 'Type of Crop', ['Potatoes', 'Wheat', 'Barley', 'Oats'])
+    migration = synthetic_cube('PEA15', (1, 35, 3), seed=2, first_year=1990)
+    _relabel(migration, 'STATISTIC', 'Statistic', ['Estimated Migration'])
+    _relabel(migration, 'C01', 'Component', ['Net migration', 'Immigrants', 'Emigrants'])
+    return {'AQA04': crops, 'PEA15': migration}
+
+
+def bench_parsing(cubes, repeat):
+    results = {}
+    for name, cube in cubes.items():
+        results[f"parse_reponse[{name}]"] = timed(
+            lambda: parse_reponse(cube['dimension'], cube['value'], cube['id'], cube['size']), repeat)
+    return results
+
+
+def bench_fetching(cubes, repeat):
+    results = {}
+    for name, cube in cubes.items():
+        table_id = cube['extension']['matrix']
+        results[f"get_cso_data[{name}]"] = timed(lambda: get_cso_data(table_id, use_cache=False), repeat)
+        years = cube['dimension']['TLIST(A1)']['category']['index'][:10]
+        results[f"get_cso_data[{name}, 10 years]"] = timed(
+            lambda: get_cso_data(table_id, {'Year': years}, use_cache=False), repeat)
+    return results
+
+
+def bench_dashboard(repeat, timeout=60):
+    # Imported here: importing the app starts loading its data from the stand-in
+    import API_call_inc as app
+
+    deadline = time.monotonic() + timeout
+    # The loader publishes the stored snapshot first and then the fetched one
+    while app.data_loader.version < 2:
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"Dashboard data didn't load: {app.data_loader.error}")
+        time.sleep(0.05)
+    snapshot, _ = app.data_loader.get()
+
+    results = {}
+    tables = fetch_cso_tables(app.CSO_TABLES)
+    results['get_merged_data'] = timed(lambda: app.get_merged_data(tables=tables), repeat)
+
+    def uncached(fn, *args):
+        def call():
+            # Every call builds the figure rather than hitting the cache
+            app.figure_cache = FigureCache(maxsize=0)
+            fn(*args)
+        return call
+
+    # The hand-picked selections, and one discovered pair as they all share one graph builder
+    selections = dict(zip(app.CORRELATION_PAIRS, app.CORRELATION_PAIRS))
+    discovered = [selection for selection in snapshot['pairs'] if selection not in app.CORRELATION_PAIRS]
+    if discovered:
+        selections['discovered'] = discovered[0]
+    year_ranges = [(app.FIRST_YEAR, app.LAST_YEAR), (2012, 2018), (2015, 2016)]
+    for name, selection in selections.items():
+        results[f"update_graph_data[{name}]"] = timed(uncached(app.update_graph_data, selection), repeat)
+        for year_range in year_ranges:
+            results[f"update_graph[{name}, {year_range[0]}-{year_range[1]}]"] = timed(
+                uncached(app.update_graph, selection, list(year_range)), repeat)
+    app.figure_cache = FigureCache()
+    return results
+
+
+def run(sizes, repeat=DEFAULT_REPEAT):
+    cubes = {name: synthetic_cube(f"SYN{n}", CUBE_SIZES[name], seed=n) for n, name in enumerate(sizes)}
+    server = PxStatServer(dict(dashboard_cubes(), **{cube['extension']['matrix']: cube for cube in cubes.values()}))
+    results = bench_parsing(cubes, repeat)
+    with server, server.use():
+        results.update(bench_fetching(cubes, repeat))
+        results.update(bench_dashboard(repeat))
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'cells': {name: int(np.prod(CUBE_SIZES[name])) for name in sizes},
+        'results': results,
+    }
+
+
+def latest_run(results_dir):
+    runs = sorted(glob.glob(os.path.join(results_dir, 'run-*.json')))
+    return runs[-1] if runs else None
+
+
+def save_run(run, results_dir=DEFAULT_RESULTS_DIR):
+    os.makedirs(results_dir, exist_ok=True)
+    path = os.path.join(results_dir, f"run-{run['timestamp'].replace(':', '')}.json")
+    with open(path, 'w') as f:
+        json.dump(run, f, indent=2)
+    return path
+
+
+def compare(run, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    Returns:
+        List of (name, baseline median, median, ratio) for every benchmark in
+        both runs, and the names of those slower by more than threshold
+    """
+    rows, regressions = [], []
+    for name, result in run['results'].items():
+        before = baseline['results'].get(name)
+        if before is None:
+            continue
+        ratio = result['median'] / before['median'] if before['median'] else float('inf')
+        rows.append((name, before['median'], result['median'], ratio))
+        if ratio > 1 + threshold and result['median'] - before['median'] > NOISE_FLOOR:
+            regressions.append(name)
+    return rows, regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the CSO ingestion, merge and callback paths")
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT)
+    parser.add_argument('--sizes', default=','.join(CUBE_SIZES), help="synthetic cubes to use, e.g. small,medium")
+    parser.add_argument('--baseline', help="run file to compare with; the latest saved run by default")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument('--results-dir', default=DEFAULT_RESULTS_DIR)
+    parser.add_argument('--no-save', action='store_true')
+    args = parser.parse_args()
+
+    baseline_path = args.baseline or latest_run(args.results_dir)
+    result = run(args.sizes.split(','), args.repeat)
+    for name, timing in result['results'].items():
+        print(f"{name:45} median {timing['median'] * 1000:9.2f} ms   min {timing['min'] * 1000:9.2f} ms")
+    if not args.no_save:
+        print(f"Saved to {save_run(result, args.results_dir)}")
+
+    if baseline_path:
+        with open(baseline_path) as f:
+            rows, regressions = compare(result, json.load(f), args.threshold)
+        print(f"\nCompared with {baseline_path}:")
+        for name, before, after, ratio in rows:
+            flag = '  REGRESSION' if name in regressions else ''
+            print(f"{name:45} {before * 1000:9.2f} -> {after * 1000:9.2f} ms ({ratio:.2f}x){flag}")
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,47 @@
+from dash import ClientsideFunction, Input, Output
+
+# Stands in for r in graphs built for the whole period; the browser swaps in r for the selected years
+R_PLACEHOLDER = '__r__'
+
+
+def graph_data(figure, explanation, df, columns, axis='Year'):
+    """
+    Everything the browser needs to redraw a correlation graph for any year range
+
+    Args:
+        figure: Figure built from the full series
+        explanation: Explanation component, with R_PLACEHOLDER wherever r is shown
+        df: DataFrame holding the axis and the series
+        columns: Columns plotted by the figure's traces, in trace order
+        axis: Column the year range is applied to
+
+    Returns:
+        Dictionary for a dcc.Store read by filter_graph in assets/clientside.js
+    """
+    return {
+        'figure': figure,
+        'explanation': explanation,
+        'placeholder': R_PLACEHOLDER,
+        'axis': df[axis].tolist(),
+        'series': [df[column].tolist() for column in columns],
+    }
+
+
+def static_graph(figure, explanation):
+    """
+    graph_data for a figure that doesn't depend on the year range, e.g. a loading message
+    """
+    return {'figure': figure, 'explanation': explanation, 'placeholder': R_PLACEHOLDER, 'axis': [], 'series': []}
+
+
+def register_year_filter(app, store_id='graph-data', slider_id='year-slider'):
+    """
+    Redraw the graph and explanation in the browser whenever the year range or the stored data changes
+    """
+    app.clientside_callback(
+        ClientsideFunction(namespace='spurious', function_name='filter_graph'),
+        [Output('correlation-graph', 'figure'),
+         Output('explanation-text', 'children')],
+        [Input(store_id, 'data'),
+         Input(slider_id, 'value')]
+    )
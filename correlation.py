@@ -0,0 +1,73 @@
+import numpy as np
+
+
+class RangeCorrelation:
+    """
+    Pearson correlation of two series over any range of a sorted axis
+
+    Running totals of n, x, y, x², y² and xy are built once, so r for any
+    [start, end] window is a couple of lookups and a handful of arithmetic
+    instead of a slice and np.corrcoef. Points where either series is NaN
+    (e.g. from outer merges) are left out of every window.
+    """
+
+    def __init__(self, axis, x, y):
+        axis = np.asarray(axis, dtype=np.float64)
+        order = np.argsort(axis, kind='stable')
+        self.axis = axis[order]
+        x = np.asarray(x, dtype=np.float64)[order]
+        y = np.asarray(y, dtype=np.float64)[order]
+
+        valid = ~(np.isnan(x) | np.isnan(y))
+        # r does not change when a constant is subtracted, and centring keeps
+        # the sums of squares small enough not to lose precision
+        x = np.where(valid, x - (x[valid].mean() if valid.any() else 0), 0)
+        y = np.where(valid, y - (y[valid].mean() if valid.any() else 0), 0)
+
+        def running(values):
+            return np.concatenate([[0], np.cumsum(values)])
+
+        self.n = running(valid.astype(np.int64))
+        self.sx = running(x)
+        self.sy = running(y)
+        self.sxx = running(x * x)
+        self.syy = running(y * y)
+        self.sxy = running(x * y)
+
+    def corr(self, start, end):
+        """
+        Returns:
+            r over start <= axis <= end, or NaN if fewer than two complete
+            points fall in the window or either series is constant there
+        """
+        lo = np.searchsorted(self.axis, start, side='left')
+        hi = np.searchsorted(self.axis, end, side='right')
+        n = self.n[hi] - self.n[lo]
+        if n < 2:
+            return np.nan
+        sx = self.sx[hi] - self.sx[lo]
+        sy = self.sy[hi] - self.sy[lo]
+        cov = (self.sxy[hi] - self.sxy[lo]) - sx * sy / n
+        var_x = (self.sxx[hi] - self.sxx[lo]) - sx * sx / n
+        var_y = (self.syy[hi] - self.syy[lo]) - sy * sy / n
+        if var_x <= 0 or var_y <= 0:
+            return np.nan
+        return float(np.clip(cov / np.sqrt(var_x * var_y), -1, 1))
+
+
+class CorrelationIndex:
+    """
+    RangeCorrelation for every configured pair of columns of a DataFrame
+
+    Args:
+        df: DataFrame holding the axis and every series
+        pairs: Dictionary of name -> (x column, y column)
+        axis: Column the windows are taken over
+    """
+
+    def __init__(self, df, pairs, axis='Year'):
+        self.pairs = dict(pairs)
+        self.ranges = {name: RangeCorrelation(df[axis], df[x], df[y]) for name, (x, y) in self.pairs.items()}
+
+    def corr(self, name, start, end):
+        return self.ranges[name].corr(start, end)
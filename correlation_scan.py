@@ -0,0 +1,204 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from cso_catalog import CATALOG
+from cso_store import load_tables
+from discovery import (DEFAULT_MIN_OVERLAP, DEFAULT_TOP_K, block_pairs, encode_groups, merge_top, no_pairs,
+                       prepare_series, rank_pairs, wide_series)
+
+# Series per side of each block pair; a task works on about 8 x DEFAULT_SCAN_BLOCK² floats (~64 MB)
+DEFAULT_SCAN_BLOCK = 1024
+# Seconds between checkpoint writes
+DEFAULT_CHECKPOINT_INTERVAL = 30
+
+# Arrays a worker process reads from shared memory, set up by _attach
+_worker = {}
+
+
+def _share(arrays):
+    """
+    Copy arrays into one shared memory segment
+
+    Returns:
+        (SharedMemory, layout) where layout is [(offset, shape, dtype)] for _attach
+    """
+    size = sum(a.nbytes for a in arrays)
+    shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    layout, offset = [], 0
+    for a in arrays:
+        np.ndarray(a.shape, a.dtype, buffer=shm.buf, offset=offset)[...] = a
+        layout.append((offset, a.shape, a.dtype.str))
+        offset += a.nbytes
+    return shm, layout
+
+
+def _attach(name, layout, group_codes, min_overlap, k):
+    """Worker initializer: map the shared series instead of receiving a pickled copy"""
+    shm = shared_memory.SharedMemory(name=name)
+    _worker['shm'] = shm
+    _worker['arrays'] = [np.ndarray(shape, np.dtype(dtype), buffer=shm.buf, offset=offset)
+                         for offset, shape, dtype in layout]
+    _worker['group_codes'] = group_codes
+    _worker['min_overlap'] = min_overlap
+    _worker['k'] = k
+
+
+def _scan_task(rows, cols):
+    x, mask = _worker['arrays']
+    return block_pairs(x, mask, rows, cols, _worker['min_overlap'], _worker['k'], _worker['group_codes'])
+
+
+def _fingerprint(prepared, columns, k, min_overlap, groups, block_size):
+    """Hash of the prepared data and the settings, so a checkpoint only resumes the same scan"""
+    x, mask = prepared
+    digest = hashlib.sha1()
+    digest.update(json.dumps([list(map(str, columns)), x.shape, k, min_overlap, block_size]).encode())
+    digest.update(x.tobytes())
+    digest.update(mask.tobytes())
+    if groups is not None:
+        digest.update(json.dumps(list(map(str, groups))).encode())
+    return digest.hexdigest()
+
+
+def _load_checkpoint(path, fingerprint):
+    """
+    Returns:
+        (set of finished task numbers, best pairs so far), empty if there is no checkpoint
+
+    Raises:
+        ValueError if the checkpoint is from a scan with other data or settings
+    """
+    if path is None or not os.path.exists(path):
+        return set(), no_pairs()
+    with np.load(path) as saved:
+        if str(saved['fingerprint']) != fingerprint:
+            raise ValueError(f"Checkpoint {path} is for a different scan")
+        best = (saved['r'], saved['i'], saved['j'], saved['n'])
+        return set(saved['done'].tolist()), best
+
+
+def _save_checkpoint(path, fingerprint, done, best):
+    tmp = f"{path}.tmp.npz"
+    r, i, j, n = best
+    np.savez(tmp, fingerprint=fingerprint, done=np.fromiter(sorted(done), dtype=np.int64), r=r, i=i, j=j, n=n)
+    # Never leave a half-written checkpoint behind
+    os.replace(tmp, path)
+
+
+def parallel_top_correlations(frame, k=DEFAULT_TOP_K, min_overlap=DEFAULT_MIN_OVERLAP, groups=None,
+                              block_size=DEFAULT_SCAN_BLOCK, max_workers=None, checkpoint=None,
+                              checkpoint_interval=DEFAULT_CHECKPOINT_INTERVAL):
+    """
+    top_correlations spread over a pool of processes
+
+    The series matrix is cut into blocks and every pair of blocks on or above
+    the diagonal is a task. The prepared series sit in shared memory, which
+    each worker maps when it starts, so only block ranges and top-k results
+    are pickled. Each worker returns the k best pairs of its block pair and
+    these are merged into one ranking as they arrive.
+
+    Args:
+        frame: DataFrame with one column per series, aligned on its index; NaN where missing
+        k: Number of pairs to return
+        min_overlap: Years both series must have
+        groups: Optional label per column; pairs within one group are skipped
+        block_size: Series per side of a block pair
+        max_workers: Number of processes; all cores by default
+        checkpoint: Optional .npz path; progress is saved there every
+            checkpoint_interval seconds and when the scan stops, and a scan
+            started with the same data and settings carries on from it
+        checkpoint_interval: Seconds between checkpoint writes
+
+    Returns:
+        pandas DataFrame with columns x, y, r and n (overlapping years), by descending |r|
+    """
+    total = frame.shape[1]
+    starts = range(0, total, block_size)
+    tasks = [((a, min(a + block_size, total)), (b, min(b + block_size, total)))
+             for a in starts for b in starts if b >= a]
+
+    prepared = prepare_series(frame)
+    fingerprint = _fingerprint(prepared, frame.columns, k, min_overlap, groups, block_size)
+    done, best = _load_checkpoint(checkpoint, fingerprint)
+    pending = [number for number in range(len(tasks)) if number not in done]
+    if not pending:
+        return rank_pairs(frame.columns, best)
+
+    shm, layout = _share(prepared)
+    # The workers read the shared copy; this one is no longer needed
+    del prepared
+    max_workers = max_workers or os.cpu_count()
+    saved_at = time.monotonic()
+    try:
+        with ProcessPoolExecutor(max_workers, initializer=_attach,
+                                 initargs=(shm.name, layout, encode_groups(groups), min_overlap, k)) as pool:
+            queue = iter(pending)
+            running = {}
+            while True:
+                # Only a few tasks in flight per worker, however many block pairs there are
+                for number in queue:
+                    running[pool.submit(_scan_task, *tasks[number])] = number
+                    if len(running) >= 4 * max_workers:
+                        break
+                if not running:
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    best = merge_top(best, future.result(), k)
+                    done.add(running.pop(future))
+                if checkpoint is not None and time.monotonic() - saved_at > checkpoint_interval:
+                    _save_checkpoint(checkpoint, fingerprint, done, best)
+                    saved_at = time.monotonic()
+    finally:
+        if checkpoint is not None:
+            _save_checkpoint(checkpoint, fingerprint, done, best)
+        shm.close()
+        shm.unlink()
+    return rank_pairs(frame.columns, best)
+
+
+def scan_cso_tables(tables, k=DEFAULT_TOP_K, min_overlap=DEFAULT_MIN_OVERLAP, offline=False, **kwargs):
+    """
+    Rank the most correlated pairs of series across CSO tables
+
+    Tables are loaded with load_tables, so they go through the same fetch and
+    parse path as the dashboards and are kept in the local store, and pivoted
+    with wide_series. Pairs from the same table are skipped.
+
+    Args:
+        tables: Dictionary of name -> (table_id, variables)
+        kwargs: Passed on to parallel_top_correlations
+
+    Returns:
+        pandas DataFrame with columns x, y, r and n, by descending |r|
+    """
+    loaded = load_tables(tables, offline=offline)
+    wide = [wide_series(loaded[name], name) for name in tables]
+    series = pd.concat(wide, axis=1).sort_index()
+    groups = [name for name, frame in zip(tables, wide) for _ in frame.columns]
+    return parallel_top_correlations(series, k=k, min_overlap=min_overlap, groups=groups, **kwargs)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Find the most correlated series across CSO tables")
+    parser.add_argument('tables', nargs='*', help="CSO table ids, e.g. AQA04 PEA15")
+    parser.add_argument('--keyword', help="scan the catalog tables matching these words instead")
+    parser.add_argument('--frequency', default='A1', help="frequency of the catalog tables to scan")
+    parser.add_argument('-k', type=int, default=DEFAULT_TOP_K, help="number of pairs to list")
+    parser.add_argument('--min-overlap', type=int, default=DEFAULT_MIN_OVERLAP)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--checkpoint', default=None, help=".npz file to save progress to and resume from")
+    args = parser.parse_args()
+
+    table_ids = args.tables or [entry['table_id'] for entry in CATALOG.search(args.keyword, frequency=args.frequency)]
+    ranking = scan_cso_tables({table_id: (table_id, None) for table_id in table_ids}, k=args.k,
+                              min_overlap=args.min_overlap, max_workers=args.workers, checkpoint=args.checkpoint)
+    print(ranking.to_string())
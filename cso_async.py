@@ -0,0 +1,130 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from cso_cache import cache_key
+from metrics import Counter
+from parse_response import DEFAULT_FETCH_WORKERS, _decode_cso_payload, _download_cso_payload
+
+COALESCED_REQUESTS = Counter('cso_coalesced_requests_total',
+                             "Requests for a CSO table answered by a download already in flight")
+
+
+class AsyncCSOFetcher:
+    """
+    asyncio front end to get_cso_data with single-flight coalescing
+
+    Every request runs on one event loop in a background thread, whatever
+    loop or thread it comes from. Requests for a (table, variables) query
+    that is already being fetched wait for that download and decode instead
+    of starting their own, and at most max_concurrency queries are fetched
+    at once. Downloads go through the same client and on-disk cache as
+    get_cso_data, on a thread pool so the loop never blocks.
+
+    Results are shared by every caller of one flight: DataFrames come back
+    as shallow copies, cubes as the same object, so treat cubes as read-only.
+    """
+
+    def __init__(self, max_concurrency=DEFAULT_FETCH_WORKERS):
+        self.max_concurrency = max_concurrency
+        self.stats = {'requests': 0, 'downloads': 0, 'coalesced': 0}
+        self._in_flight = {}
+        self._loop = None
+        self._semaphore = None
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _ensure_loop(self):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._pool = ThreadPoolExecutor(self.max_concurrency, thread_name_prefix='cso-async')
+                self._loop.set_default_executor(self._pool)
+                self._semaphore = asyncio.Semaphore(self.max_concurrency)
+                threading.Thread(target=self._loop.run_forever, name='cso-async-loop', daemon=True).start()
+            return self._loop
+
+    async def _download_and_decode(self, table_id, variables, use_cache, as_cube):
+        loop = asyncio.get_running_loop()
+        async with self._semaphore:
+            self.stats['downloads'] += 1
+            status_code, payload = await loop.run_in_executor(
+                None, _download_cso_payload, table_id, variables, use_cache)
+            if status_code != 200:
+                print(f"Error fetching data for {table_id}: {status_code}")
+                return None if as_cube else pd.DataFrame()
+            return await loop.run_in_executor(None, _decode_cso_payload, payload, as_cube)
+
+    async def _fetch(self, table_id, variables, use_cache, as_cube):
+        # Runs on the fetcher's own loop, so _in_flight needs no lock
+        key = (cache_key(table_id, variables), use_cache, as_cube)
+        self.stats['requests'] += 1
+        flight = self._in_flight.get(key)
+        if flight is None:
+            flight = asyncio.ensure_future(self._download_and_decode(table_id, variables, use_cache, as_cube))
+            self._in_flight[key] = flight
+            flight.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        else:
+            self.stats['coalesced'] += 1
+            COALESCED_REQUESTS.inc()
+        # Shielded so one caller giving up doesn't cancel the download for the rest
+        result = await asyncio.shield(flight)
+        return result.copy(deep=False) if isinstance(result, pd.DataFrame) else result
+
+    def _submit(self, table_id, variables, use_cache, as_cube):
+        return asyncio.run_coroutine_threadsafe(
+            self._fetch(table_id, variables, use_cache, as_cube), self._ensure_loop())
+
+    async def get(self, table_id, variables=None, use_cache=True, as_cube=False):
+        """
+        Awaitable get_cso_data, from any event loop
+
+        Returns:
+            pandas DataFrame (a Cube if as_cube), empty (None) if the request failed
+        """
+        return await asyncio.wrap_future(self._submit(table_id, variables, use_cache, as_cube))
+
+    async def get_many(self, tables, use_cache=True, as_cube=False):
+        """
+        Fetch several queries at once; a query that fails is reported and
+        comes back empty without affecting the rest
+
+        Args:
+            tables: Dictionary of name -> (table_id, variables)
+
+        Returns:
+            Dictionary of name -> pandas DataFrame (or Cube), in the order of tables
+        """
+        results = await asyncio.gather(
+            *(self.get(table_id, variables, use_cache, as_cube) for table_id, variables in tables.values()),
+            return_exceptions=True)
+        frames = {}
+        for (name, (table_id, _)), result in zip(tables.items(), results):
+            if isinstance(result, Exception):
+                print(f"Error fetching data for {table_id}: {result}")
+                result = None if as_cube else pd.DataFrame()
+            frames[name] = result
+        return frames
+
+    def get_sync(self, table_id, variables=None, use_cache=True, as_cube=False, timeout=None):
+        """
+        get for synchronous code: blocks the calling thread, but still shares
+        downloads with every other caller, sync or async
+        """
+        return self._submit(table_id, variables, use_cache, as_cube).result(timeout)
+
+    def get_many_sync(self, tables, use_cache=True, as_cube=False, timeout=None):
+        """get_many for synchronous code"""
+        return asyncio.run_coroutine_threadsafe(
+            self.get_many(tables, use_cache, as_cube), self._ensure_loop()).result(timeout)
+
+    def summary(self):
+        stats = self.stats
+        return (f"Async CSO fetcher: {stats['requests']} requests, {stats['downloads']} downloads, "
+                f"{stats['coalesced']} coalesced")
+
+
+# Fetcher shared by every caller in the process, so they all coalesce together
+FETCHER = AsyncCSOFetcher()
@@ -0,0 +1,225 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+from metrics import CallbackMetric
+
+# Where raw CSO responses are kept between runs
+DEFAULT_CACHE_DIR = os.environ.get(
+    'CSO_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cso_cache'))
+# How long a cached table is served without asking the CSO whether it changed
+DEFAULT_TTL = 24 * 60 * 60
+# Least recently used tables are evicted once the cache grows past this
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+
+def cache_key(table_id, variables=None):
+    """
+    Key identifying one CSO query: the table id plus its variables filter
+    """
+    query = json.dumps(variables or {}, sort_keys=True)
+    return hashlib.sha1(f"{table_id}\n{query}".encode('utf-8')).hexdigest()
+
+
+class CSOCache:
+    """
+    Persistent on-disk cache of raw CSO PxStat responses
+
+    Payloads younger than the TTL are served straight from disk. Older ones
+    are revalidated with an ETag/Last-Modified conditional request, so an
+    unchanged table costs a 304 instead of a full download. The cache is kept
+    under max_bytes by evicting the least recently used tables.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_DIR, ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.stats = {'hits': 0, 'misses': 0, 'revalidated': 0, 'stale': 0, 'evictions': 0}
+        self._lock = threading.Lock()
+        # One lock per key, so concurrent misses on a query make a single request
+        self._key_locks = {}
+        self._index = self._load_index()
+
+    def _index_path(self):
+        return os.path.join(self.path, 'index.json')
+
+    def _payload_path(self, key):
+        return os.path.join(self.path, f'{key}.json')
+
+    def _load_index(self):
+        try:
+            with open(self._index_path(), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_index(self):
+        os.makedirs(self.path, exist_ok=True)
+        tmp = self._index_path() + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self._index, f)
+        os.replace(tmp, self._index_path())
+
+    def _read(self, key):
+        try:
+            with open(self._payload_path(key), 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _count(self, stat):
+        with self._lock:
+            self.stats[stat] += 1
+
+    def _touch(self, key, validated=False):
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is None:
+                return
+            entry['last_used'] = time.time()
+            if validated:
+                entry['validated_at'] = entry['last_used']
+            self._save_index()
+
+    def _store(self, key, table_id, variables, response):
+        payload = response.content
+        if len(payload) > self.max_bytes:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        # A name of its own per writer, never shared with another thread or process
+        fd, tmp = tempfile.mkstemp(dir=self.path, prefix=f'{key}.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(payload)
+            os.replace(tmp, self._payload_path(key))
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+
+        now = time.time()
+        with self._lock:
+            self._index[key] = {
+                'table_id': table_id,
+                'variables': variables,
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'validated_at': now,
+                'last_used': now,
+                'size': len(payload),
+            }
+            self._evict()
+            self._save_index()
+
+    def _evict(self):
+        total = sum(entry['size'] for entry in self._index.values())
+        for key in sorted(self._index, key=lambda k: self._index[k]['last_used']):
+            if total <= self.max_bytes:
+                break
+            total -= self._index.pop(key)['size']
+            self.stats['evictions'] += 1
+            try:
+                os.remove(self._payload_path(key))
+            except OSError:
+                pass
+
+    def fetch(self, table_id, variables, request, validate=None):
+        """
+        Return the raw payload of a CSO query, downloading it only if needed
+
+        Args:
+            table_id: The ID of the table to fetch
+            variables: Dictionary of variables to filter by
+            request: Callable taking a dict of extra request headers and
+                returning a requests.Response
+            validate: Optional callable telling from a 200 response's payload
+                whether it is worth keeping; payloads it rejects, e.g. JSON-RPC
+                error envelopes, are handed back but never cached
+
+        Returns:
+            (status code, payload bytes); the status code is 200 whenever a
+            payload is returned, even if it came from disk
+        """
+        key = cache_key(table_id, variables)
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        # Callers asking for the same query at once wait for the first one and then hit its copy
+        with key_lock:
+            return self._fetch(key, table_id, variables, request, validate)
+
+    def _fetch(self, key, table_id, variables, request, validate):
+        with self._lock:
+            entry = self._index.get(key)
+        payload = self._read(key) if entry is not None else None
+        if payload is None:
+            entry = None
+
+        if entry is not None and time.time() - entry['validated_at'] < self.ttl:
+            self._count('hits')
+            self._touch(key)
+            return 200, payload
+
+        headers = {}
+        if entry is not None:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        try:
+            response = request(headers)
+        except OSError:
+            # requests exceptions are OSErrors; fall back on the stale copy if there is one
+            if entry is None:
+                raise
+            self._count('stale')
+            self._touch(key)
+            return 200, payload
+        if response.status_code == 304 and entry is not None:
+            self._count('revalidated')
+            self._touch(key, validated=True)
+            return 200, payload
+        rejected = response.status_code == 200 and validate is not None and not validate(response.content)
+        if response.status_code != 200 or rejected:
+            if entry is not None:
+                # Better to show last known data than nothing at all
+                self._count('stale')
+                self._touch(key)
+                return 200, payload
+            if rejected:
+                return 200, response.content
+            return response.status_code, None
+
+        self._count('misses')
+        self._store(key, table_id, variables, response)
+        return 200, response.content
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._index):
+                try:
+                    os.remove(self._payload_path(key))
+                except OSError:
+                    pass
+            self._index = {}
+            self._save_index()
+
+    def summary(self):
+        requests_made = self.stats['hits'] + self.stats['misses'] + self.stats['revalidated'] + self.stats['stale']
+        size = sum(entry['size'] for entry in self._index.values())
+        return (f"CSO cache: {self.stats['hits']} hits, {self.stats['revalidated']} revalidated, "
+                f"{self.stats['misses']} misses, {self.stats['stale']} stale of {requests_made} lookups; "
+                f"{len(self._index)} tables, {size / 1e6:.1f} MB")
+
+
+# Cache shared by every get_cso_data call in the process
+CACHE = CSOCache()
+
+CallbackMetric('cso_cache_events_total', "Lookups in the CSO response cache, by outcome", 'counter',
+               lambda: {(('event', event),): count for event, count in CACHE.stats.items()})
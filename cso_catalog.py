@@ -0,0 +1,204 @@
+import argparse
+import json
+import os
+import re
+import threading
+import time
+
+from cso_client import CLIENT, CSO_API_BASE
+
+CSO_COLLECTION_URL = CSO_API_BASE + "/public/api.restful/PxStat.Data.Cube_API.ReadCollection"
+# Where the catalog of every CSO table is kept
+DEFAULT_CATALOG_PATH = os.environ.get(
+    'CSO_CATALOG_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cso_catalog.json'))
+# Names of the PxStat time dimension frequency codes, e.g. the A1 of TLIST(A1)
+FREQUENCIES = {'A': 'Annual', 'Q': 'Quarterly', 'M': 'Monthly', 'W': 'Weekly', 'D': 'Daily'}
+
+_WORD = re.compile(r'\w+')
+
+
+def _words(text):
+    return _WORD.findall(str(text).casefold())
+
+
+def _time_dimension(item):
+    time_ids = item.get('role', {}).get('time') or [d for d in item.get('id', []) if d.startswith('TLIST')]
+    return time_ids[0] if time_ids else None
+
+
+def catalog_entry(item):
+    """
+    Summarise one table of a ReadCollection response
+
+    Args:
+        item: JSON-stat dataset object without values
+
+    Returns:
+        Dictionary with the table id, label, last update, frequency, time
+        coverage and dimensions, plus the metadata needed by plan_query
+    """
+    dimensions = item['dimension']
+    ids = item.get('id', list(dimensions))
+    time_dim = _time_dimension(item)
+    frequency = periods = None
+    if time_dim is not None:
+        match = re.search(r'\((\w+)\)', time_dim)
+        frequency = match.group(1) if match else None
+        category = dimensions[time_dim]['category']
+        index = category.get('index') or list(category.get('label', {}))
+        periods = sorted(index, key=index.get) if isinstance(index, dict) else list(index)
+    return {
+        'table_id': item.get('extension', {}).get('matrix'),
+        'label': item.get('label'),
+        'updated': item.get('updated'),
+        'frequency': frequency,
+        'time_dimension': time_dim,
+        'first_period': periods[0] if periods else None,
+        'last_period': periods[-1] if periods else None,
+        'dimensions': [{'id': d, 'label': dimensions[d].get('label', d)} for d in ids],
+        'metadata': {'id': ids, 'size': item.get('size'), 'role': item.get('role', {}), 'dimension': dimensions},
+    }
+
+
+def sync_catalog(path=DEFAULT_CATALOG_PATH):
+    """
+    Download the metadata of every CSO table and store it as the local catalog
+
+    One ReadCollection request covers the whole catalog, so this doesn't
+    make a call per table.
+
+    Returns:
+        Number of tables in the catalog
+
+    Raises:
+        requests.HTTPError if the CSO does not answer with the collection
+    """
+    response = CLIENT.get(CSO_COLLECTION_URL)
+    response.raise_for_status()
+    collection = response.json()
+    collection = collection.get('result', collection)
+    entries = [catalog_entry(item) for item in collection.get('link', {}).get('item', [])]
+    entries = [entry for entry in entries if entry['table_id']]
+
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump({'synced': time.time(), 'tables': entries}, f)
+    os.replace(tmp, path)
+    CATALOG.reload()
+    return len(entries)
+
+
+class CSOCatalog:
+    """
+    Local catalog of CSO tables with indexed lookup
+
+    The catalog file written by sync_catalog is read on first use and
+    indexed by word (in table, dimension and category labels), by
+    dimension and by frequency, so searches are a few set intersections.
+    An empty catalog is used if the file doesn't exist yet.
+    """
+
+    def __init__(self, path=DEFAULT_CATALOG_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._tables = None
+
+    def reload(self):
+        with self._lock:
+            self._tables = None
+
+    def _load(self):
+        with self._lock:
+            if self._tables is not None:
+                return
+            try:
+                with open(self.path) as f:
+                    entries = json.load(f)['tables']
+            except (OSError, ValueError, KeyError):
+                entries = []
+
+            words, dimensions, frequencies = {}, {}, {}
+            for entry in entries:
+                table_id = entry['table_id']
+                text = [table_id, entry['label']]
+                for dimension in entry['dimensions']:
+                    for name in (dimension['id'], dimension['label']):
+                        dimensions.setdefault(str(name).casefold(), set()).add(table_id)
+                    text.append(dimension['label'])
+                    text.extend(entry['metadata']['dimension'][dimension['id']]['category'].get('label', {}).values())
+                for word in _words(' '.join(map(str, text))):
+                    words.setdefault(word, set()).add(table_id)
+                if entry['frequency']:
+                    frequencies.setdefault(entry['frequency'][0].upper(), set()).add(table_id)
+            self._words, self._dimensions, self._frequencies = words, dimensions, frequencies
+            self._tables = {entry['table_id']: entry for entry in entries}
+
+    def __len__(self):
+        self._load()
+        return len(self._tables)
+
+    def get(self, table_id):
+        """
+        Returns:
+            The catalog entry of a table, or None if it isn't in the catalog
+        """
+        self._load()
+        return self._tables.get(table_id)
+
+    def metadata(self, table_id):
+        """
+        Returns:
+            The table's dimensions in the form get_cso_metadata returns, or None
+        """
+        entry = self.get(table_id)
+        return entry['metadata'] if entry else None
+
+    def search(self, keyword=None, dimension=None, frequency=None):
+        """
+        Find tables by keyword, dimension and frequency; all given filters must match
+
+        Args:
+            keyword: Words that must all appear in the table's label or in the
+                labels of its dimensions or categories, in any case
+            dimension: Dimension id or label, e.g. "Sex"
+            frequency: Frequency code or name, e.g. "A1", "A" or "annual"
+
+        Returns:
+            List of catalog entries without their metadata, by table id
+        """
+        self._load()
+        matches = [set(self._tables)]
+        if keyword:
+            matches.extend(self._words.get(word, set()) for word in _words(keyword))
+        if dimension:
+            matches.append(self._dimensions.get(str(dimension).casefold(), set()))
+        if frequency:
+            code = frequency[0].upper()
+            named = [c for c, name in FREQUENCIES.items() if name.casefold() == frequency.casefold()]
+            matches.append(self._frequencies.get(named[0] if named else code, set()))
+        found = set.intersection(*matches)
+        return [{k: v for k, v in self._tables[table_id].items() if k != 'metadata'} for table_id in sorted(found)]
+
+
+# Catalog shared by every module in the process
+CATALOG = CSOCatalog()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Sync or search the local catalog of CSO tables")
+    parser.add_argument('keyword', nargs='?', help="words to search table, dimension and category labels for")
+    parser.add_argument('--dimension')
+    parser.add_argument('--frequency', help="e.g. A1, Q or annual")
+    parser.add_argument('--sync', action='store_true', help="download the catalog from the CSO first")
+    args = parser.parse_args()
+
+    if args.sync or not os.path.exists(CATALOG.path):
+        print(f"Catalog synced: {sync_catalog()} tables")
+    print(f"{len(CATALOG)} tables in the catalog")
+    start = time.perf_counter()
+    found = CATALOG.search(args.keyword, args.dimension, args.frequency)
+    seconds = time.perf_counter() - start
+    for entry in found:
+        print(f"{entry['table_id']:8} {entry['frequency'] or '':3} {entry['first_period']}-{entry['last_period']}  "
+              f"{entry['label']}")
+    print(f"{len(found)} tables in {seconds * 1000:.1f} ms")
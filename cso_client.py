@@ -0,0 +1,122 @@
+import os
+import random
+import threading
+import time
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.request import ACCEPT_ENCODING
+
+from metrics import STAGE_SECONDS, Counter
+
+# Root of the PxStat API; set CSO_API_BASE to e.g. a pxstat_server.py address to work offline
+CSO_API_BASE = os.environ.get('CSO_API_BASE', "https://ws.cso.ie").rstrip('/')
+# Responses worth retrying: rate limiting and server-side failures
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# (connect, read) timeout in seconds for every request
+DEFAULT_TIMEOUT = (5, 60)
+DEFAULT_RETRIES = 4
+# Base and cap, in seconds, of the exponential backoff between retries
+DEFAULT_BACKOFF = 0.5
+MAX_BACKOFF = 30
+# Connections kept alive per host; matches the number of parallel table fetches
+DEFAULT_POOL_SIZE = 8
+
+HTTP_REQUESTS = Counter('cso_http_requests_total', "Requests made to the CSO API, by status")
+HTTP_BYTES = Counter('cso_http_downloaded_bytes_total', "Bytes downloaded from the CSO API, not counting streamed responses")
+
+
+class CSOClient:
+    """
+    Shared HTTP client for the CSO PxStat API
+
+    Keeps a pool of keep-alive connections, asks for compressed responses,
+    puts a timeout on every request and retries 429/5xx responses and
+    connection errors with exponential backoff and full jitter. Every
+    attempt is recorded in timings.
+    """
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF,
+                 pool_size=DEFAULT_POOL_SIZE, max_timings=1000):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.session = requests.Session()
+        # gzip/deflate always, br as well when a brotli decoder is installed
+        self.session.headers['Accept-Encoding'] = ACCEPT_ENCODING
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.timings = deque(maxlen=max_timings)
+        self._lock = threading.Lock()
+
+    def _record(self, url, status, seconds, attempt, response, stream):
+        size = None
+        if response is not None and not stream:
+            size = len(response.content)
+            HTTP_BYTES.inc(size)
+        HTTP_REQUESTS.inc(status=status)
+        STAGE_SECONDS.observe(seconds, stage='fetch')
+        with self._lock:
+            self.timings.append({
+                'url': url,
+                'status': status,
+                'seconds': seconds,
+                'attempt': attempt,
+                'bytes': size,
+            })
+
+    def _delay(self, attempt, response):
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(int(retry_after), MAX_BACKOFF)
+        return random.uniform(0, min(MAX_BACKOFF, self.backoff * 2 ** attempt))
+
+    def get(self, url, params=None, headers=None, stream=False):
+        """
+        GET a URL, retrying transient failures
+
+        Returns:
+            The final requests.Response, which may still be an error status
+            once the retries are used up
+
+        Raises:
+            requests.RequestException if the last attempt could not connect
+            or timed out
+        """
+        for attempt in range(self.retries + 1):
+            start = time.perf_counter()
+            response = None
+            try:
+                response = self.session.get(url, params=params, headers=headers, stream=stream,
+                                            timeout=self.timeout)
+                status = response.status_code
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self.retries:
+                    self._record(url, type(e).__name__, time.perf_counter() - start, attempt, None, stream)
+                    raise
+                status = type(e).__name__
+            self._record(url, status, time.perf_counter() - start, attempt, response, stream)
+
+            if response is not None and (status not in RETRY_STATUSES or attempt == self.retries):
+                return response
+            time.sleep(self._delay(attempt, response))
+            if response is not None:
+                response.close()
+
+    def summary(self):
+        with self._lock:
+            timings = list(self.timings)
+        if not timings:
+            return "CSO client: no requests"
+        seconds = sorted(t['seconds'] for t in timings)
+        retries = sum(1 for t in timings if t['attempt'] > 0)
+        downloaded = sum(t['bytes'] or 0 for t in timings)
+        return (f"CSO client: {len(timings)} requests ({retries} retries), "
+                f"median {seconds[len(seconds) // 2]:.2f}s, max {seconds[-1]:.2f}s, "
+                f"{downloaded / 1e6:.1f} MB downloaded")
+
+
+# Client shared by every CSO request in the process
+CLIENT = CSOClient()
@@ -0,0 +1,223 @@
+import numpy as np
+import pandas as pd
+
+from parse_response import (_category_codes, _compact_values, _dimension_layout, _smallest_int_dtype, _sparse_cells,
+                            dataset_attrs)
+
+
+class Cube:
+    """
+    CSO table as one N-d array with a label index per dimension
+
+    Selecting by label looks positions up in a dictionary and slices the
+    array, instead of scanning every row of a long DataFrame. Single labels,
+    slices and runs of consecutive labels give views of the same memory;
+    other lists of labels need numpy's fancy indexing and copy.
+
+    Dimensions can be named by id ('C01', 'TLIST(A1)') or label ('Type of
+    Crop', 'Year'), and categories by label or code.
+
+    Attributes:
+        values: The N-d float array, dimensions in the order of dims
+        dims: Dimension ids
+        labels: Dictionary of dimension id -> pandas Index of category labels in array order
+        attrs: Table-level details, as on the DataFrames from get_cso_data
+    """
+
+    def __init__(self, values, dims, labels, codes=None, attrs=None):
+        self.values = values
+        self.dims = list(dims)
+        self.labels = {d: pd.Index(labels[d]) for d in self.dims}
+        self.codes = {d: list(codes[d]) if codes and d in codes else list(self.labels[d]) for d in self.dims}
+        self.attrs = dict(attrs or {})
+        self._positions = {}
+
+    @classmethod
+    def from_jsonstat(cls, data):
+        """
+        Build a cube from a JSON-stat 2.0 dataset, dense or sparse 'value'
+        """
+        ids = data.get('id') or list(data['dimension'])
+        sizes = data.get('size') or [len(data['dimension'][d]['category']['index']) for d in ids]
+        total, layout = _dimension_layout(data['dimension'], ids, sizes)
+        values = data['value']
+        if isinstance(values, dict):
+            positions, entries = _sparse_cells(values, total)
+            flat = np.full(total, np.nan, dtype=np.float64)
+            flat[positions] = _compact_values(entries)
+        else:
+            flat = _compact_values(values)
+        labels, codes = {}, {}
+        for d, _, _, remap, categories in layout:
+            labels[d] = categories[remap]
+            codes[d] = _category_codes(data['dimension'][d])
+        return cls(flat.reshape(sizes), ids, labels, codes, dataset_attrs(data))
+
+    @classmethod
+    def from_frame(cls, frame, value='value'):
+        """
+        Build a cube from a long DataFrame like those of get_cso_data or load_tables
+
+        Every column but value is a dimension, with its categories (or sorted
+        unique values) as labels; cells with no row are NaN.
+        """
+        dims = [c for c in frame.columns if c not in (value, 'status')]
+        labels, positions = {}, []
+        for d in dims:
+            column = frame[d]
+            if isinstance(column.dtype, pd.CategoricalDtype):
+                labels[d], codes = column.cat.categories, column.cat.codes.to_numpy()
+            else:
+                codes, labels[d] = pd.factorize(column, sort=True)
+            positions.append(codes)
+        shape = tuple(len(labels[d]) for d in dims)
+        values = frame[value].to_numpy()
+        cells = np.full(int(np.prod(shape, dtype=np.int64)), np.nan, dtype=values.dtype)
+        if len(frame):
+            cells[np.ravel_multi_index(positions, shape)] = values
+        dimension_labels = frame.attrs.get('dimension_labels', {})
+        attrs = dict(frame.attrs, dimension_labels={d: dimension_labels.get(d, d) for d in dims})
+        return cls(cells.reshape(shape), dims, labels, attrs=attrs)
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    def __repr__(self):
+        dims = ', '.join(f"{self.dim_label(d)}: {n}" for d, n in zip(self.dims, self.shape))
+        return f"<Cube {self.attrs.get('label') or ''} ({dims})>"
+
+    def dim_label(self, d):
+        return self.attrs.get('dimension_labels', {}).get(d, d)
+
+    def axis(self, name):
+        """
+        Returns:
+            Position of a dimension given by id or label, case-insensitively
+
+        Raises:
+            KeyError if the cube has no such dimension
+        """
+        wanted = str(name).casefold()
+        for i, d in enumerate(self.dims):
+            if d.casefold() == wanted or str(self.dim_label(d)).casefold() == wanted:
+                return i
+        raise KeyError(f"No dimension {name!r}; the cube has {[self.dim_label(d) for d in self.dims]}")
+
+    def _position(self, d, category):
+        if d not in self._positions:
+            index = {}
+            for i, code in enumerate(self.codes[d]):
+                index.setdefault(str(code), i)
+            for i, label in enumerate(self.labels[d]):
+                index.setdefault(str(label), i)
+            self._positions[d] = index
+        try:
+            return self._positions[d][str(category)]
+        except KeyError:
+            raise KeyError(f"{self.dim_label(d)} has no {category!r}") from None
+
+    def _indexer(self, d, selection):
+        """Positional indexer for a label selection along dimension d"""
+        if isinstance(selection, slice):
+            start = None if selection.start is None else self._position(d, selection.start)
+            stop = None if selection.stop is None else self._position(d, selection.stop) + 1
+            return slice(start, stop, selection.step)
+        if isinstance(selection, (list, tuple, range, np.ndarray, pd.Index)):
+            return [self._position(d, category) for category in selection]
+        return self._position(d, selection)
+
+    def sel(self, selection=None, **kwargs):
+        """
+        Select by label: a label drops the dimension, a list of labels or a
+        slice of labels (both ends included) keeps it
+
+        Args:
+            selection: Dictionary of dimension -> labels, for dimension names
+                that aren't valid keywords, e.g. {'Type of Crop': 'Potatoes'}
+            kwargs: Dimension -> labels
+
+        Returns:
+            Cube, sharing memory with this one where numpy allows
+        """
+        selection = dict(selection or {}, **kwargs)
+        positions = {}
+        for name, labels in selection.items():
+            d = self.dims[self.axis(name)]
+            positions[d] = self._indexer(d, labels)
+        return self.isel(positions)
+
+    def isel(self, selection=None, **kwargs):
+        """
+        Select by position, like sel; a list of consecutive positions becomes a slice
+        """
+        selection = dict(selection or {}, **kwargs)
+        indexers = [slice(None)] * len(self.dims)
+        for name, indexer in selection.items():
+            i = self.axis(name)
+            if isinstance(indexer, (list, tuple, range, np.ndarray)):
+                indexer = list(indexer)
+                if indexer and indexer == list(range(indexer[0], indexer[0] + len(indexer))) and indexer[0] >= 0:
+                    indexer = slice(indexer[0], indexer[0] + len(indexer))
+            indexers[i] = indexer
+
+        # numpy applies list indexers all together; one at a time gives the outer product
+        values = self.values
+        lists = [i for i, indexer in enumerate(indexers) if isinstance(indexer, list)]
+        values = values[tuple(slice(None) if i in lists else indexer for i, indexer in enumerate(indexers))]
+        kept = [i for i, indexer in enumerate(indexers) if not isinstance(indexer, (int, np.integer))]
+        for i in lists:
+            values = np.take(values, indexers[i], axis=kept.index(i))
+
+        dims = [self.dims[i] for i in kept]
+        labels = {self.dims[i]: self.labels[self.dims[i]][indexers[i]] for i in kept}
+        codes = {self.dims[i]: list(np.asarray(self.codes[self.dims[i]], dtype=object)[indexers[i]]) for i in kept}
+        return Cube(values, dims, labels, codes, self.attrs)
+
+    def reduce(self, func, dim):
+        """
+        Apply a numpy reduction such as np.nansum along a named dimension
+        """
+        i = self.axis(dim)
+        dims = self.dims[:i] + self.dims[i + 1:]
+        return Cube(func(self.values, axis=i), dims, {d: self.labels[d] for d in dims},
+                    {d: self.codes[d] for d in dims}, self.attrs)
+
+    def sum(self, dim):
+        """Sum along a dimension, leaving out missing cells"""
+        return self.reduce(np.nansum, dim)
+
+    def mean(self, dim):
+        """Mean along a dimension, leaving out missing cells"""
+        return self.reduce(np.nanmean, dim)
+
+    def to_series(self):
+        """
+        Values of a one-dimensional cube as a pandas Series indexed by label
+        """
+        if len(self.dims) != 1:
+            raise ValueError(f"to_series needs one dimension, the cube has {len(self.dims)}")
+        d = self.dims[0]
+        return pd.Series(self.values, index=self.labels[d].rename(self.dim_label(d)))
+
+    def to_frame(self):
+        """
+        Long DataFrame with the same columns as get_cso_data
+
+        Dimension columns are categoricals built from repeats and tiles of
+        their positions, and 'value' is the array flattened (without a copy
+        when the cube is contiguous).
+        """
+        shape = self.shape
+        total = int(np.prod(shape, dtype=np.int64))
+        columns, inner = {}, total
+        for d, size in zip(self.dims, shape):
+            inner //= max(size, 1)
+            remap, categories = pd.factorize(self.labels[d])
+            remap = remap.astype(_smallest_int_dtype(size))
+            outer = total // max(size * inner, 1)
+            columns[d] = pd.Categorical.from_codes(np.tile(np.repeat(remap, inner), outer), categories=categories)
+        columns['value'] = self.values.reshape(-1)
+        frame = pd.DataFrame(columns, copy=False)
+        frame.attrs.update(self.attrs)
+        return frame
@@ -0,0 +1,438 @@
+import json
+import os
+import re
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from cso_cache import DEFAULT_TTL, cache_key
+from parse_response import (DEFAULT_CHUNK_SIZE, DEFAULT_FETCH_WORKERS, _category_codes, _coordinates,
+                            _dimension_layout, _iter_cso_chunks, dataset_attrs, fetch_cso_tables, get_cso_data,
+                            get_cso_metadata, plan_query)
+
+# Where decoded CSO tables are kept, one directory per table and release
+DEFAULT_STORE_DIR = os.environ.get(
+    'CSO_STORE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cso_store'))
+# Number of releases of each table kept on disk
+DEFAULT_KEEP_RELEASES = 2
+# Most recent stored periods fetched again when a table has been updated
+DEFAULT_REVISION_WINDOW = 2
+
+
+def table_dir(table_id, variables=None, root=DEFAULT_STORE_DIR):
+    """
+    Directory holding every stored release of a CSO query
+    """
+    if variables:
+        return os.path.join(root, f"{table_id}-{cache_key(table_id, variables)[:10]}")
+    return os.path.join(root, table_id)
+
+
+def _release_name(updated):
+    """Sortable directory name for a release, from the table's 'updated' stamp"""
+    if updated:
+        return re.sub(r'[^0-9A-Za-z]', '', updated)
+    return time.strftime('%Y%m%dT%H%M%SZ', time.gmtime())
+
+
+def list_releases(table_id, variables=None, root=DEFAULT_STORE_DIR):
+    """
+    Stored releases of a CSO query, oldest first
+    """
+    path = table_dir(table_id, variables, root)
+    if not os.path.isdir(path):
+        return []
+    return sorted(name for name in os.listdir(path)
+                  if '.tmp' not in name and os.path.exists(os.path.join(path, name, 'meta.json')))
+
+
+def _publish(tmp, table_id, variables, release, root, keep):
+    """Move a fully written release into place and drop old releases"""
+    path = table_dir(table_id, variables, root)
+    final = os.path.join(path, release)
+    if os.path.exists(final):
+        # Same release stored already; just mark it as freshly checked
+        shutil.rmtree(tmp)
+        os.utime(final)
+    else:
+        os.replace(tmp, final)
+    for old in list_releases(table_id, variables, root)[:-keep]:
+        shutil.rmtree(os.path.join(path, old), ignore_errors=True)
+    return final
+
+
+def _new_release_dir(table_id, variables, root):
+    path = table_dir(table_id, variables, root)
+    tmp = os.path.join(path, f"{time.time_ns()}.tmp-{os.getpid()}")
+    os.makedirs(tmp)
+    return tmp
+
+
+def _write_meta(path, table_id, variables, attrs, columns):
+    meta = {
+        'table_id': table_id,
+        'variables': variables,
+        'label': attrs.get('label'),
+        'updated': attrs.get('updated'),
+        'columns': columns,
+    }
+    with open(os.path.join(path, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+
+
+def write_columns(frame, path, labels=None):
+    """
+    Save every column of a frame as one .npy file in path, the layout
+    load_release maps back: categorical and string columns as their codes,
+    numeric columns as they are
+
+    Args:
+        frame: DataFrame to save
+        path: Existing directory to write into
+        labels: Optional dictionary of column -> label
+
+    Returns:
+        List of column entries for meta.json
+    """
+    labels = labels or {}
+    columns = []
+    for i, (name, column) in enumerate(frame.items()):
+        entry = {'name': name, 'label': labels.get(name, name), 'file': f'col_{i}.npy', 'categories': None}
+        # is_string_dtype covers object columns as well as pandas' own str dtype
+        if isinstance(column.dtype, pd.CategoricalDtype) or pd.api.types.is_string_dtype(column.dtype):
+            column = column.astype('category')
+            entry['categories'] = column.cat.categories.tolist()
+            data = column.cat.codes.to_numpy()
+        else:
+            data = column.to_numpy()
+        np.save(os.path.join(path, entry['file']), data)
+        columns.append(entry)
+    return columns
+
+
+def write_table(frame, table_id, variables=None, root=DEFAULT_STORE_DIR, keep=DEFAULT_KEEP_RELEASES, release=None):
+    """
+    Store a decoded CSO table as a new release
+
+    Every column becomes one .npy file: categorical columns as their codes,
+    with the categories in meta.json, and numeric columns as they are.
+
+    Args:
+        frame: DataFrame from get_cso_data
+        table_id: The ID of the table
+        variables: The variables the table was fetched with
+        root: Store directory
+        keep: Number of releases to keep
+        release: Directory name of the release; by default it comes from the
+            table's 'updated' stamp, and storing a release that is already
+            there only marks it as freshly checked
+
+    Returns:
+        Path of the release directory
+    """
+    tmp = _new_release_dir(table_id, variables, root)
+    columns = write_columns(frame, tmp, frame.attrs.get('dimension_labels'))
+    _write_meta(tmp, table_id, variables, frame.attrs, columns)
+    return _publish(tmp, table_id, variables, release or _release_name(frame.attrs.get('updated')), root, keep)
+
+
+def save_cso_data(table_id, variables=None, root=DEFAULT_STORE_DIR, chunk_size=DEFAULT_CHUNK_SIZE,
+                  keep=DEFAULT_KEEP_RELEASES):
+    """
+    Stream a CSO table straight into the store as a new release
+
+    The response is decoded chunk by chunk and written through memory maps,
+    so memory use does not grow with the size of the table. Tables sent
+    with a sparse 'value' object only get rows for their populated cells.
+
+    Args:
+        table_id: The ID of the table to fetch
+        variables: Dictionary of dimension -> categories to keep, see plan_query
+        root: Store directory
+        chunk_size: Number of cells decoded at a time
+        keep: Number of releases to keep
+
+    Returns:
+        Path of the release directory, or None if nothing was fetched
+    """
+    tmp = None
+    for metadata, start, values in _iter_cso_chunks(table_id, variables, chunk_size, sparse=True):
+        if isinstance(start, np.ndarray):
+            # The populated cells of a sparse table, all at once; written chunk_size rows at a time
+            chunks = [(row, start[row:row + chunk_size], values[row:row + chunk_size])
+                      for row in range(0, len(start), chunk_size)]
+        else:
+            chunks = [(start, np.arange(start, start + len(values), dtype=np.int64), values)]
+        if tmp is None:
+            total, layout = _dimension_layout(metadata['dimension'], metadata.get('id'), metadata.get('size'))
+            rows = len(start) if isinstance(start, np.ndarray) else total
+            tmp = _new_release_dir(table_id, variables, root)
+            dimension_labels = dataset_attrs(metadata)['dimension_labels']
+            columns = []
+            arrays = []
+            for i, (d, _, _, remap, categories) in enumerate(layout):
+                columns.append({'name': d, 'label': dimension_labels[d], 'file': f'col_{i}.npy',
+                                'categories': list(categories)})
+                arrays.append(np.lib.format.open_memmap(os.path.join(tmp, columns[-1]['file']), mode='w+',
+                                                        dtype=remap.dtype, shape=(rows,)))
+            columns.append({'name': 'value', 'label': 'value', 'file': f'col_{len(layout)}.npy', 'categories': None})
+            arrays.append(np.lib.format.open_memmap(os.path.join(tmp, columns[-1]['file']), mode='w+',
+                                                    dtype=np.float64, shape=(rows,)))
+
+        for row, positions, part in chunks:
+            for array, column in zip(arrays, _coordinates(layout, positions).values()):
+                array[row:row + len(positions)] = column.codes
+            arrays[-1][row:row + len(part)] = part
+
+    if tmp is None:
+        return None
+    for array in arrays:
+        array.flush()
+    del arrays
+    # Keys after 'value' in the response are only known once the stream is done
+    attrs = dataset_attrs(metadata)
+    _write_meta(tmp, table_id, variables, attrs, columns)
+    return _publish(tmp, table_id, variables, _release_name(attrs['updated']), root, keep)
+
+
+def load_release(path, columns=None, labels=False):
+    """
+    Open a stored release
+
+    Columns are memory-mapped rather than read, so opening a table costs
+    next to nothing and processes opening the same table share its pages.
+
+    Args:
+        path: Release directory
+        columns: Columns to load, by dimension id or label; all by default
+        labels: Name the columns by dimension label rather than id
+
+    Returns:
+        pandas DataFrame with the same columns as get_cso_data
+    """
+    with open(os.path.join(path, 'meta.json'), encoding='utf-8') as f:
+        meta = json.load(f)
+
+    entries = meta['columns']
+    if columns is not None:
+        wanted = [str(c).casefold() for c in columns]
+        entries = [e for e in entries if e['name'].casefold() in wanted or str(e['label']).casefold() in wanted]
+
+    data = {}
+    for entry in entries:
+        array = np.load(os.path.join(path, entry['file']), mmap_mode='r')
+        if entry['categories'] is not None:
+            # The codes were valid when written; validating would read every page
+            array = pd.Categorical.from_codes(array, categories=entry['categories'], validate=False)
+        data[entry['label'] if labels else entry['name']] = array
+    # Without copy=False pandas would read every mapped column into process memory
+    frame = pd.DataFrame(data, copy=False)
+    frame.attrs.update({
+        'label': meta['label'],
+        'updated': meta['updated'],
+        'dimension_labels': {e['name']: e['label'] for e in meta['columns']},
+    })
+    return frame
+
+
+def open_table(table_id, variables=None, columns=None, labels=False, release=None, root=DEFAULT_STORE_DIR):
+    """
+    Open the latest (or a given) stored release of a CSO query
+
+    Raises:
+        FileNotFoundError if the query has not been stored
+    """
+    releases = list_releases(table_id, variables, root)
+    if release is None:
+        if not releases:
+            raise FileNotFoundError(f"{table_id} is not in the store at {root}")
+        release = releases[-1]
+    return load_release(os.path.join(table_dir(table_id, variables, root), release), columns, labels)
+
+
+def _is_fresh(table_id, variables, root, max_age):
+    releases = list_releases(table_id, variables, root)
+    if not releases:
+        return False
+    if max_age is None:
+        return True
+    checked = os.path.getmtime(os.path.join(table_dir(table_id, variables, root), releases[-1]))
+    return time.time() - checked < max_age
+
+
+def load_tables(tables, columns=None, labels=False, max_age=DEFAULT_TTL, offline=False, root=DEFAULT_STORE_DIR,
+                max_workers=DEFAULT_FETCH_WORKERS):
+    """
+    Open several CSO queries from the store, fetching the ones that are missing
+
+    Tables stored less than max_age seconds ago are opened without touching
+    the network. Older ones are brought up to date with sync_tables, and
+    missing ones are fetched together with fetch_cso_tables and stored
+    first. If a fetch fails the last stored release is used.
+
+    Args:
+        tables: Dictionary of name -> (table_id, variables)
+        columns: Columns to load, by dimension id or label; all by default
+        labels: Name the columns by dimension label rather than id
+        max_age: Seconds before a stored table is checked for updates; None never checks
+        offline: Only use what is stored; missing tables come back empty
+        root: Store directory
+        max_workers: Maximum number of downloads in flight
+
+    Returns:
+        Dictionary of name -> pandas DataFrame, in the order of tables
+    """
+    stale = {name: query for name, query in tables.items() if not _is_fresh(*query, root, max_age)}
+    if stale and not offline:
+        stored = {name: query for name, query in stale.items() if list_releases(*query, root)}
+        missing = {name: query for name, query in stale.items() if name not in stored}
+        if stored:
+            sync_tables(stored, root=root, max_workers=max_workers)
+        if missing:
+            fetched = fetch_cso_tables(missing, max_workers=max_workers)
+            with ThreadPoolExecutor(max_workers) as pool:
+                list(pool.map(lambda name: write_table(fetched[name], *missing[name], root=root),
+                              [name for name in missing if not fetched[name].empty]))
+
+    frames = {}
+    for name, (table_id, variables) in tables.items():
+        try:
+            frames[name] = open_table(table_id, variables, columns, labels, root=root)
+        except FileNotFoundError:
+            frames[name] = pd.DataFrame()
+    return frames
+
+
+def _time_dimension(metadata):
+    time_ids = metadata.get('role', {}).get('time')
+    if time_ids:
+        return time_ids[0]
+    return next((d for d in metadata['id'] if d.upper().startswith('TLIST')), None)
+
+
+def _full_sync(table_id, variables, root):
+    if save_cso_data(table_id, variables, root=root) is None:
+        raise ValueError(f"Could not fetch {table_id}")
+    return {'full': True, 'new': [], 'revised': []}
+
+
+def _append_periods(stored, fetched, time_dim, drop_labels, period_order):
+    """
+    Replace the rows of drop_labels in stored with fetched, merging categories
+    and keeping the rows in period_order
+    """
+    keep = ~stored[time_dim].isin(drop_labels).to_numpy()
+    columns = {}
+    for name, column in stored.items():
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            columns[name] = union_categoricals([column[keep].array, pd.Categorical(fetched[name])])
+        else:
+            columns[name] = np.concatenate([column.to_numpy()[keep], fetched[name].to_numpy()])
+    frame = pd.DataFrame(columns)
+    order = pd.Categorical(frame[time_dim], categories=period_order).codes
+    frame = frame.iloc[np.argsort(order, kind='stable')].reset_index(drop=True)
+    frame.attrs.update(fetched.attrs)
+    return frame
+
+
+def sync_table(table_id, variables=None, revision_window=DEFAULT_REVISION_WINDOW, root=DEFAULT_STORE_DIR):
+    """
+    Bring a stored CSO query up to date, downloading only what changed
+
+    The table's metadata is compared with the latest stored release. Time
+    periods the store does not have yet are requested, plus the last
+    revision_window stored periods if the table has been updated since, as
+    those are the ones the CSO revises. They are appended to the stored data
+    as a new release. A table that has never been stored is fetched in full.
+
+    Args:
+        table_id: The ID of the table
+        variables: Dictionary of dimension -> categories to keep, see plan_query
+        revision_window: Number of most recent stored periods re-fetched after an update
+        root: Store directory
+
+    Returns:
+        Dictionary with the 'new' and 'revised' period labels fetched, and
+        'full' telling whether the whole table had to be fetched
+    """
+    try:
+        stored = open_table(table_id, variables, root=root)
+    except FileNotFoundError:
+        return _full_sync(table_id, variables, root)
+
+    metadata = get_cso_metadata(table_id, use_cache=False)
+    time_dim = _time_dimension(metadata)
+    if time_dim is None or time_dim not in stored:
+        return _full_sync(table_id, variables, root)
+
+    # Periods the query covers, oldest first
+    dimension = metadata['dimension'][time_dim]
+    codes = _category_codes(dimension)
+    if variables:
+        selected = plan_query(table_id, variables, metadata)['params']['dimension']
+        if time_dim in selected:
+            wanted = set(selected[time_dim]['category']['index'])
+            codes = [code for code in codes if code in wanted]
+    labels = dimension['category'].get('label', {})
+    period_labels = {code: labels.get(code, code) for code in codes}
+
+    stored_labels = set(stored[time_dim].unique())
+    new = [code for code in codes if period_labels[code] not in stored_labels]
+    revised = []
+    if metadata.get('updated') != stored.attrs.get('updated') and revision_window:
+        revised = [code for code in codes if period_labels[code] in stored_labels][-revision_window:]
+
+    release = os.path.join(table_dir(table_id, variables, root), list_releases(table_id, variables, root)[-1])
+    if not new and not revised:
+        os.utime(release)
+        return {'full': False, 'new': [], 'revised': []}
+
+    query = dict(variables or {})
+    for name in list(query):
+        if name in (time_dim, dimension.get('label')):
+            del query[name]
+    query[time_dim] = new + revised
+    fetched = get_cso_data(table_id, query, use_cache=False)
+    if fetched.empty:
+        raise ValueError(f"Could not fetch new periods of {table_id}")
+
+    frame = _append_periods(stored, fetched, time_dim, [period_labels[code] for code in revised],
+                            list(period_labels.values()))
+    # The CSO can add periods without touching 'updated'; a name of its own keeps the
+    # new release from being taken for the stored one. The suffix sorts after it.
+    release = f"{_release_name(frame.attrs.get('updated'))}-{time.time_ns():020d}"
+    write_table(frame, table_id, variables, root=root, release=release)
+    return {
+        'full': False,
+        'new': [period_labels[code] for code in new],
+        'revised': [period_labels[code] for code in revised],
+    }
+
+
+def sync_tables(tables, revision_window=DEFAULT_REVISION_WINDOW, root=DEFAULT_STORE_DIR,
+                max_workers=DEFAULT_FETCH_WORKERS):
+    """
+    Incrementally refresh several stored CSO queries at once
+
+    A table that fails to sync is reported and left as it was.
+
+    Args:
+        tables: Dictionary of name -> (table_id, variables)
+
+    Returns:
+        Dictionary of name -> result of sync_table, or None for failures
+    """
+    def sync(item):
+        name, (table_id, variables) = item
+        try:
+            return name, sync_table(table_id, variables, revision_window, root)
+        except Exception as e:
+            print(f"Error syncing {table_id}: {e}")
+            return name, None
+
+    with ThreadPoolExecutor(max_workers) as pool:
+        return dict(pool.map(sync, tables.items()))
@@ -1,22 +1,30 @@
-import pandas as pd
 import numpy as np
 
-mig_df = pd.read_csv('C:\\Users\\Hackathon_05\\Downloads\\PEA15.20250402T130435.csv')
+from cso_cube import Cube
+from cso_store import load_tables
+
+# Map PEA15 and AQA04 from the local store (downloading them once if needed)
+# and only load the columns used below
+tables = load_tables({'migration': ("PEA15", None), 'potato': ("AQA04", None)},
+                     columns=['Component', 'Type of Crop', 'Statistic', 'Year', 'value'], labels=True)
+
+mig_df = tables['migration']
 print(mig_df.head())
 
 mig_filtered = mig_df[mig_df['Component'] == 'Net migration']
-mig_filtered = mig_filtered[mig_filtered['Year'] >= 2010]
+mig_filtered = mig_filtered[mig_filtered['Year'].astype(int) >= 2010]
 print(mig_filtered)
 
 
 
 
-potato_df = pd.read_csv('C:\\Users\\Hackathon_05\\Downloads\\AQA04.20250402T130456.csv')
+potato_df = tables['potato']
 print(potato_df.head())
 
-potato_filtered = potato_df[potato_df['Type of Crop'] == 'Potatoes']
-potato_filtered = potato_filtered[potato_filtered['Year'] >= 2010] 
-potato_filtered = potato_filtered[potato_filtered['Statistic Label'] == 'Crop Production']
+# As a cube, the selection is a few label lookups and a view instead of a scan per condition
+potato_cube = Cube.from_frame(potato_df)
+potato_filtered = potato_cube.sel({'Type of Crop': 'Potatoes', 'Statistic': 'Crop Production',
+                                   'Year': slice('2010', None)}).to_series()
 print(potato_filtered)
 
 
@@ -0,0 +1,155 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from cso_store import load_release, write_columns
+
+# Where filtered CSV exports are kept in binary form, one directory per file and query
+DEFAULT_CSV_CACHE_DIR = os.environ.get(
+    'CSO_CSV_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.csv_cache'))
+# Rows parsed at a time
+DEFAULT_CSV_CHUNK_ROWS = 100_000
+# Column of CSO CSV exports holding the cell values
+VALUE_COLUMN = 'VALUE'
+
+
+def _source(path):
+    stat = os.stat(path)
+    return {'path': os.path.abspath(path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def _csv_key(source, columns, where, dtypes):
+    """Cache key of a query on a CSV file, changing whenever the file does"""
+    query = [source['path'], source['size'], source['mtime_ns'], columns,
+             {name: sorted(values) for name, values in sorted(where.items())},
+             {name: str(dtype) for name, dtype in sorted(dtypes.items())}]
+    return hashlib.sha1(json.dumps(query).encode()).hexdigest()
+
+
+def _allowed(where):
+    """Predicate values as strings, the way categories come out of the CSV"""
+    return {name: sorted({str(v) for v in ([values] if isinstance(values, (str, int, float)) else values)})
+            for name, values in (where or {}).items()}
+
+
+def _dtype(name, dtypes):
+    """dtype a column is parsed as: VALUE as float64, everything else as categories"""
+    return dtypes.get(name, np.float64 if name == VALUE_COLUMN else 'category')
+
+
+def _read_chunks(path, columns, where, dtypes, chunksize):
+    header = pd.read_csv(path, nrows=0, encoding='utf-8-sig').columns.tolist()
+    wanted = columns or header
+    for name in list(wanted) + list(where):
+        if name not in header:
+            raise ValueError(f"{path} has no column {name!r}")
+    read = [name for name in header if name in wanted or name in where]
+    dtype = {name: _dtype(name, dtypes) for name in read}
+
+    for chunk in pd.read_csv(path, usecols=read, dtype=dtype, chunksize=chunksize, encoding='utf-8-sig'):
+        if where:
+            keep = np.ones(len(chunk), dtype=bool)
+            for name, values in where.items():
+                column = chunk[name]
+                if not isinstance(column.dtype, pd.CategoricalDtype):
+                    column = column.astype(str)
+                keep &= column.isin(values).to_numpy()
+            chunk = chunk[keep]
+        if len(chunk):
+            yield chunk[[name for name in read if name in wanted]]
+
+
+def _concat(chunks, columns, dtypes):
+    if not chunks:
+        # Same dtypes as a non-empty result, so a reload from the cache matches
+        return pd.DataFrame({name: pd.Series(dtype=_dtype(name, dtypes)) for name in columns})
+    data = {}
+    for name in chunks[0].columns:
+        parts = [chunk[name] for chunk in chunks]
+        if isinstance(parts[0].dtype, pd.CategoricalDtype):
+            # Categories differ from chunk to chunk; only the ones that survived the filter are kept
+            data[name] = union_categoricals([part.array for part in parts]).remove_unused_categories()
+        else:
+            data[name] = np.concatenate([part.to_numpy() for part in parts])
+    return pd.DataFrame(data)
+
+
+def _drop_outdated(cache_dir, source):
+    """Remove cached queries on earlier versions of the file"""
+    for name in os.listdir(cache_dir):
+        try:
+            with open(os.path.join(cache_dir, name, 'meta.json'), encoding='utf-8') as f:
+                cached = json.load(f).get('source') or {}
+        except (OSError, ValueError):
+            continue
+        if cached.get('path') == source['path'] and cached != source:
+            shutil.rmtree(os.path.join(cache_dir, name), ignore_errors=True)
+
+
+def _write_cache(frame, path, source):
+    """
+    Save a frame in the store's release layout, one .npy per column, so
+    cso_store.load_release can memory-map it back
+    """
+    tmp = f"{path}.tmp-{os.getpid()}-{time.time_ns()}"
+    os.makedirs(tmp)
+    columns = write_columns(frame, tmp)
+    with open(os.path.join(tmp, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump({'label': None, 'updated': None, 'source': source, 'columns': columns}, f)
+    try:
+        os.replace(tmp, path)
+    except OSError:
+        # Another process cached the same query first
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def read_cso_csv(path, columns=None, where=None, dtypes=None, chunksize=DEFAULT_CSV_CHUNK_ROWS,
+                 cache_dir=DEFAULT_CSV_CACHE_DIR):
+    """
+    Load a CSO CSV export, keeping only the rows and columns asked for
+
+    The file is parsed chunksize rows at a time with explicit dtypes (VALUE
+    as float64, everything else as categories) and only the columns needed,
+    and each chunk is filtered before the next is read, so rows left out
+    never pile up in memory. The result is cached in binary form, keyed on
+    the file's path, size and modification time and on the query, and later
+    calls memory-map it instead of parsing the CSV again.
+
+    Args:
+        path: CSV file, e.g. as downloaded from data.cso.ie
+        columns: Columns to return, by header name; all by default
+        where: Dictionary of column -> value or values to keep, e.g.
+            {'Component': 'Net migration', 'Year': range(2010, 2024)};
+            compared as text
+        dtypes: Dictionary of column -> dtype overriding the defaults
+        chunksize: Rows parsed at a time
+        cache_dir: Directory of the binary cache; None to always parse the CSV
+
+    Returns:
+        pandas DataFrame with the columns asked for, in file order
+
+    Raises:
+        ValueError if a column asked for or filtered on isn't in the file
+    """
+    where = _allowed(where)
+    dtypes = dtypes or {}
+    source = _source(path)
+    cached = None
+    if cache_dir is not None:
+        cached = os.path.join(cache_dir, _csv_key(source, columns, where, dtypes))
+        if os.path.exists(os.path.join(cached, 'meta.json')):
+            return load_release(cached)
+
+    chunks = list(_read_chunks(path, columns, where, dtypes, chunksize))
+    frame = _concat(chunks, columns or pd.read_csv(path, nrows=0, encoding='utf-8-sig').columns.tolist(), dtypes)
+    if cached is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        _drop_outdated(cache_dir, source)
+        _write_cache(frame, cached, source)
+    return frame
@@ -7,6 +7,14 @@ import plotly.express as px
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 
+from clientside_graph import R_PLACEHOLDER, graph_data, register_year_filter
+from correlation import CorrelationIndex
+from csv_ingest import read_cso_csv
+
+# Filter by year range in the browser: the server only sends each pair's full series
+# when the selection changes, instead of on every slider movement
+CLIENTSIDE_FILTERING = True
+
 # Initialize the Dash app
 app = dash.Dash(__name__, title="Spurious Ireland: Correlation ≠ Causation")
 
@@ -23,24 +31,31 @@ data = {
     'GDP_Growth_Rate': [1.8, 0.2, 0.0, 1.6, 8.6, 25.2, 3.7, 9.1, 9.0, 5.7, -3.0, 13.6, 12.0, 2.5]
 }
 
-mig_df = pd.read_csv('C:\\Users\\Hackathon_05\\Downloads\\PEA15.20250402T130435.csv')
-print(mig_df.head())
-
-mig_filtered = mig_df[mig_df['Component'] == 'Net migration']
-mig_filtered = mig_filtered[mig_filtered['Year'].between(2010, 2023)]
+# Rows are filtered while the CSV is read, and the result is cached in binary
+# form so later starts don't parse the CSV at all
+mig_filtered = read_cso_csv('C:\\Users\\Hackathon_05\\Downloads\\PEA15.20250402T130435.csv',
+                            columns=['Year', 'Component', 'VALUE'],
+                            where={'Component': 'Net migration', 'Year': years})
 print(mig_filtered)
 
 
-potato_df = pd.read_csv('C:\\Users\\Hackathon_05\\Downloads\\AQA04.20250402T130456.csv')
-print(potato_df.head())
-
-potato_filtered = potato_df[potato_df['Type of Crop'] == 'Potatoes']
-potato_filtered = potato_filtered[potato_filtered['Year'].between(2010, 2023)]
-potato_filtered = potato_filtered[potato_filtered['Statistic Label'] == 'Crop Production']
+potato_filtered = read_cso_csv('C:\\Users\\Hackathon_05\\Downloads\\AQA04.20250402T130456.csv',
+                               columns=['Statistic Label', 'Year', 'Type of Crop', 'VALUE'],
+                               where={'Type of Crop': 'Potatoes', 'Statistic Label': 'Crop Production',
+                                      'Year': years})
 print(potato_filtered)
 
 df = pd.DataFrame(data)
 
+# Series compared by each option of the correlation selector
+CORRELATION_PAIRS = {
+    'potato_migration': ('Potato_Yield_Tonnes_per_Hectare', 'Net_Migration_Thousands'),
+    'marriages_gdp': ('Marriages', 'GDP_Growth_Rate'),
+}
+
+# Running sums behind the correlation for any year range
+correlations = CorrelationIndex(df, CORRELATION_PAIRS)
+
 # Add correlation calculations
 corr_potato_migration = round(np.corrcoef(potato_filtered['VALUE'], mig_filtered['VALUE'])[0,1], 2)
 corr_marriages_gdp = round(np.corrcoef(df['Marriages'], df['GDP_Growth_Rate'])[0, 1], 2)
@@ -84,6 +99,9 @@ app.layout = html.Div([
     html.Div([
         dcc.Graph(id='correlation-graph')
     ]),
+
+    # Full series of the selected pair, filtered by year in the browser
+    dcc.Store(id='graph-data'),
     
     html.Div(id='explanation-text', 
              style={'margin': '20px', 'padding': '15px', 'backgroundColor': '#F0FFF0', 'borderRadius': '10px'}),
@@ -99,15 +117,7 @@ app.layout = html.Div([
 ], style={'margin': '0 auto', 'maxWidth': '1200px', 'padding': '20px'})
 
 # Callbacks
-@app.callback(
-    [Output('correlation-graph', 'figure'),
-     Output('explanation-text', 'children')],
-    [Input('correlation-selector', 'value'),
-     Input('year-slider', 'value')]
-)
-def update_graph(selected_correlation, year_range):
-    filtered_df = df[(df['Year'] >= year_range[0]) & (df['Year'] <= year_range[1])]
-    
+def build_graph(filtered_df, selected_correlation, filtered_corr):
     if selected_correlation == 'potato_migration':
         # Create subplot with two y-axes
         fig = make_subplots(specs=[[{"secondary_y": True}]])
@@ -148,9 +158,6 @@ def update_graph(selected_correlation, year_range):
         fig.update_yaxes(title_text="Potato Yield (tonnes/hectare)", secondary_y=False)
         fig.update_yaxes(title_text="Net Migration (thousands)", secondary_y=True)
         
-        # Calculate updated correlation
-        filtered_corr = round(np.corrcoef(filtered_df['Potato_Yield_Tonnes_per_Hectare'], filtered_df['Net_Migration_Thousands'])[0, 1], 2)
-        
         explanation = html.Div([
             html.H3(f"Potato Yields & Migration: r = {filtered_corr}", style={'textAlign': 'center', 'color': '#4B0082'}),
             html.P([
@@ -205,9 +212,6 @@ def update_graph(selected_correlation, year_range):
         fig.update_yaxes(title_text="Number of Marriages", secondary_y=False)
         fig.update_yaxes(title_text="GDP Growth Rate (%)", secondary_y=True)
         
-        # Calculate updated correlation
-        filtered_corr = round(np.corrcoef(filtered_df['Marriages'], filtered_df['GDP_Growth_Rate'])[0, 1], 2)
-        
         explanation = html.Div([
             html.H3(f"Marriages & GDP Growth: r = {filtered_corr}", style={'textAlign': 'center', 'color': '#4B0082'}),
             html.P([
@@ -225,5 +229,28 @@ def update_graph(selected_correlation, year_range):
     return fig, explanation
 
 
+def update_graph(selected_correlation, year_range):
+    filtered_df = df[(df['Year'] >= year_range[0]) & (df['Year'] <= year_range[1])]
+    filtered_corr = round(correlations.corr(selected_correlation, *year_range), 2)
+    return build_graph(filtered_df, selected_correlation, filtered_corr)
+
+
+def update_graph_data(selected_correlation):
+    fig, explanation = build_graph(df, selected_correlation, R_PLACEHOLDER)
+    return graph_data(fig, explanation, df, CORRELATION_PAIRS[selected_correlation])
+
+
+if CLIENTSIDE_FILTERING:
+    app.callback(Output('graph-data', 'data'), [Input('correlation-selector', 'value')])(update_graph_data)
+    register_year_filter(app)
+else:
+    app.callback(
+        [Output('correlation-graph', 'figure'),
+         Output('explanation-text', 'children')],
+        [Input('correlation-selector', 'value'),
+         Input('year-slider', 'value')]
+    )(update_graph)
+
+
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
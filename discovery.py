@@ -0,0 +1,179 @@
+import numpy as np
+import pandas as pd
+
+from periods import to_annual
+
+# Number of pairs returned by top_correlations
+DEFAULT_TOP_K = 20
+# Years two series must both have for their correlation to count
+DEFAULT_MIN_OVERLAP = 8
+# Rows of the correlation matrix computed at a time; memory is about
+# 6 x block_size x N floats, so ~250 MB for 20,000 series
+DEFAULT_BLOCK_SIZE = 256
+
+
+def wide_series(data, name):
+    """
+    Pivot an annual CSO table to one column per series
+
+    Args:
+        data: DataFrame from get_cso_data or load_tables, with one time dimension;
+            quarterly and monthly tables are averaged over each year
+        name: Prefix for the series names, usually the table name
+
+    Returns:
+        pandas DataFrame indexed by Year with a column for every combination of
+        the other dimensions, named "name: label, label"; dimensions with a
+        single category are left out of the names
+    """
+    if data.empty:
+        return pd.DataFrame(index=pd.Index([], dtype=int, name='Year'))
+    data = to_annual(data)
+    time_column = next(c for c in data.columns if c.startswith('TLIST'))
+    others = [c for c in data.columns if c not in (time_column, 'value', 'status') and data[c].nunique() > 1]
+    data = data.assign(Year=data[time_column].astype(int))
+    if not others:
+        return data.set_index('Year')[['value']].rename(columns={'value': name})
+
+    wide = data.pivot_table(index='Year', columns=others, values='value', aggfunc='first', observed=True)
+    wide.columns = [f"{name}: {', '.join(map(str, key if isinstance(key, tuple) else (key,)))}"
+                    for key in wide.columns]
+    return wide
+
+
+def prepare_series(frame):
+    """
+    Returns:
+        (x, mask): the columns of frame centred on their means with 0 where
+        missing, and where each series has a value
+    """
+    values = frame.to_numpy(dtype=np.float64)
+    mask = ~np.isnan(values)
+    counts = mask.sum(axis=0)
+    means = np.where(mask, values, 0).sum(axis=0) / np.maximum(counts, 1)
+    # Centring keeps the sums of squares small; r doesn't change
+    return np.where(mask, values - means, 0), mask
+
+
+def _block(x, mask, rows, cols, min_overlap):
+    """
+    Pearson r and overlap of series rows against series cols over the years both have
+
+    Returns:
+        (r, n) as len(rows) x len(cols) arrays; r is NaN where the overlap is
+        below min_overlap or either series is constant over it
+    """
+    xb, mb = x[:, rows], mask[:, rows].astype(np.float64)
+    xc, mc = x[:, cols], mask[:, cols].astype(np.float64)
+    n = mb.T @ mc
+    sx = xb.T @ mc
+    sy = mb.T @ xc
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sxx = (xb * xb).T @ mc
+        var_x = sxx - sx * sx / n
+        syy = mb.T @ (xc * xc)
+        var_y = syy - sy * sy / n
+        cov = xb.T @ xc - sx * sy / n
+        r = cov / np.sqrt(var_x * var_y)
+    # Relative tolerance so series that are constant apart from rounding don't count
+    valid = (n >= min_overlap) & (var_x > 1e-12 * sxx) & (var_y > 1e-12 * syy)
+    return np.where(valid, np.clip(r, -1, 1), np.nan), n
+
+
+def block_pairs(x, mask, rows, cols, min_overlap, k, group_codes):
+    """
+    The k pairs with the largest |r| among series rows x cols, each as i < j
+
+    Args:
+        rows, cols: (start, stop) ranges of series
+
+    Returns:
+        (r, i, j, n) arrays
+    """
+    r, n = _block(x, mask, slice(*rows), slice(*cols), min_overlap)
+    # Upper triangle only: every pair once, no series against itself
+    keep = np.arange(*cols)[None, :] > np.arange(*rows)[:, None]
+    keep &= ~np.isnan(r)
+    if group_codes is not None:
+        keep &= group_codes[rows[0]:rows[1], None] != group_codes[None, cols[0]:cols[1]]
+    i, j = np.nonzero(keep)
+    if len(i) > k:
+        top = np.argpartition(-np.abs(r[i, j]), k - 1)[:k]
+        i, j = i[top], j[top]
+    return r[i, j], i + rows[0], j + cols[0], n[i, j]
+
+
+def no_pairs():
+    """Empty (r, i, j, n) arrays to merge found pairs into"""
+    return np.empty(0), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0)
+
+
+def merge_top(best, found, k):
+    """The k pairs with the largest |r| of two sets of (r, i, j, n) arrays"""
+    merged = tuple(np.concatenate(arrays) for arrays in zip(best, found))
+    if len(merged[0]) > k:
+        top = np.argpartition(-np.abs(merged[0]), k - 1)[:k]
+        merged = tuple(a[top] for a in merged)
+    return merged
+
+
+def rank_pairs(columns, best):
+    """DataFrame of (r, i, j, n) pairs by descending |r|, series named from columns"""
+    r, i, j, n = best
+    order = np.argsort(-np.abs(r), kind='stable')
+    names = np.asarray(columns, dtype=object)
+    return pd.DataFrame({
+        'x': names[i[order]],
+        'y': names[j[order]],
+        'r': r[order],
+        'n': n[order].astype(np.int64),
+    })
+
+
+def encode_groups(groups):
+    """Integer code per column of its group, for block_pairs; None without groups"""
+    return pd.factorize(pd.Index(groups))[0] if groups is not None else None
+
+
+def correlation_matrix(frame, min_overlap=DEFAULT_MIN_OVERLAP):
+    """
+    Full N x N Pearson matrix of the columns of frame, each pair over the years both have
+
+    Only for moderate N; use top_correlations for tens of thousands of series.
+    """
+    x, mask = prepare_series(frame)
+    every = slice(None)
+    r, _ = _block(x, mask, every, every, min_overlap)
+    return pd.DataFrame(r, index=frame.columns, columns=frame.columns)
+
+
+def top_correlations(frame, k=DEFAULT_TOP_K, min_overlap=DEFAULT_MIN_OVERLAP, groups=None,
+                     block_size=DEFAULT_BLOCK_SIZE):
+    """
+    Find the most strongly correlated pairs of columns
+
+    The matrix is computed a block of rows at a time, against the columns to
+    the right only, and just the k largest |r| of each block are kept, so
+    memory stays bounded however many series there are.
+
+    Args:
+        frame: DataFrame with one column per series, aligned on its index; NaN where missing
+        k: Number of pairs to return
+        min_overlap: Years both series must have
+        groups: Optional label per column; pairs within one group (e.g. the
+            same table) are skipped as they are usually related for real
+        block_size: Rows of the matrix computed at a time
+
+    Returns:
+        pandas DataFrame with columns x, y, r and n (overlapping years), by descending |r|
+    """
+    x, mask = prepare_series(frame)
+    total = x.shape[1]
+    group_codes = encode_groups(groups)
+
+    best = no_pairs()
+    for start in range(0, total, block_size):
+        rows = (start, min(start + block_size, total))
+        found = block_pairs(x, mask, rows, (start, total), min_overlap, k, group_codes)
+        best = merge_top(best, found, k)
+    return rank_pairs(frame.columns, best)
@@ -0,0 +1,71 @@
+import json
+import threading
+from collections import OrderedDict
+
+from plotly.io.json import to_json_plotly
+
+from metrics import timed
+
+# Number of rendered callback results kept; covers every selection x year range of the dashboard
+DEFAULT_MAXSIZE = 256
+
+
+class FigureCache:
+    """
+    Bounded LRU cache of rendered callback outputs
+
+    Outputs are stored fully serialized (plain JSON-ready dicts), so a hit
+    skips building the figure and the components as well as serializing
+    them. Every entry belongs to one data version; the first call with a
+    new version drops everything cached for the old one.
+    """
+
+    def __init__(self, maxsize=DEFAULT_MAXSIZE):
+        self.maxsize = maxsize
+        self.version = None
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, version, build):
+        """
+        Return the cached outputs for key, calling build() to make them on a miss
+
+        Args:
+            key: Hashable callback inputs
+            version: Version of the data the outputs are built from
+            build: Function returning the callback outputs as a tuple
+        """
+        with self._lock:
+            if version != self.version:
+                if self._entries:
+                    self.stats['invalidations'] += 1
+                self._entries.clear()
+                self.version = version
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.stats['hits'] += 1
+                return self._entries[key]
+            self.stats['misses'] += 1
+
+        outputs = build()
+        with timed('serialize'):
+            outputs = tuple(json.loads(to_json_plotly(output)) for output in outputs)
+
+        with self._lock:
+            # Data may have been refreshed while building; don't keep outputs of the old version
+            if version == self.version:
+                self._entries[key] = outputs
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+                    self.stats['evictions'] += 1
+        return outputs
+
+    def hit_rate(self):
+        lookups = self.stats['hits'] + self.stats['misses']
+        return self.stats['hits'] / lookups if lookups else 0.0
+
+    def summary(self):
+        return (f"Figure cache: {self.stats['hits']} hits, {self.stats['misses']} misses "
+                f"({self.hit_rate():.0%} hit rate), {len(self._entries)} entries, "
+                f"{self.stats['evictions']} evictions, {self.stats['invalidations']} invalidations")
@@ -0,0 +1,188 @@
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds, in seconds, of the stage duration histogram buckets
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# Content type of the Prometheus text exposition format
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _sample(name, labels, value):
+    if labels:
+        name += '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in labels) + '}'
+    if value == math.inf:
+        return f"{name} +Inf"
+    return f"{name} {value!r}" if isinstance(value, float) else f"{name} {value}"
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, registry=None):
+        self.name = name
+        self.help = help
+        self._lock = threading.Lock()
+        self._values = {}
+        (registry or REGISTRY).register(self)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, labels, value) for labels, value in sorted(self._values.items())]
+
+    def exposition(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(_sample(name, labels, value) for name, labels, value in self.samples())
+        return lines
+
+
+class Counter(_Metric):
+    """Total that only goes up, e.g. requests made"""
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """Value that goes up and down, e.g. memory in use"""
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[tuple(sorted(labels.items()))] = value
+
+
+class Histogram(_Metric):
+    """Distribution of observations, e.g. durations, in cumulative buckets"""
+    kind = 'histogram'
+
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS, registry=None):
+        super().__init__(name, help, registry)
+        self.buckets = tuple(buckets) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            values = sorted((labels, (list(counts), total)) for labels, (counts, total) in self._values.items())
+        samples = []
+        for labels, (counts, total) in values:
+            for bound, count in zip(self.buckets, counts):
+                samples.append((f"{self.name}_bucket", labels + (('le', '+Inf' if bound == math.inf else bound),),
+                                count))
+            samples.append((f"{self.name}_sum", labels, total))
+            samples.append((f"{self.name}_count", labels, counts[-1]))
+        return samples
+
+
+class CallbackMetric(_Metric):
+    """
+    Metric read from elsewhere when scraped, e.g. counts a class already keeps
+
+    Args:
+        collect: Function returning a dictionary of labels -> value, the labels
+            as a tuple of (name, value) pairs
+    """
+
+    def __init__(self, name, help, kind, collect, registry=None):
+        super().__init__(name, help, registry)
+        self.kind = kind
+        self.collect = collect
+
+    def samples(self):
+        return [(self.name, tuple(sorted(labels)), value) for labels, value in self.collect().items()]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics[metric.name] = metric
+
+    def exposition(self):
+        """
+        Returns:
+            Every metric in the Prometheus text format
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            try:
+                lines.extend(metric.exposition())
+            except Exception as e:
+                # A broken callback shouldn't take the whole endpoint down
+                lines.append(f"# {metric.name} unavailable: {e}")
+        return '\n'.join(lines) + '\n'
+
+
+# Registry every module records into and /metrics serves
+REGISTRY = Registry()
+
+STAGE_SECONDS = Histogram('cso_stage_seconds', "Time spent in each stage of loading and drawing the CSO data")
+ROWS_DECODED = Counter('cso_rows_decoded_total', "Rows of CSO tables decoded into DataFrames")
+
+
+def _memory():
+    values = {}
+    try:
+        with open('/proc/self/statm') as f:
+            values[(('kind', 'resident'),)] = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Kilobytes on Linux, bytes on macOS
+        values[(('kind', 'peak_resident'),)] = peak if os.uname().sysname == 'Darwin' else peak * 1024
+    except ImportError:
+        pass
+    return values
+
+
+CallbackMetric('process_memory_bytes', "Memory used by the dashboard process", 'gauge', _memory)
+
+
+def timed(stage):
+    """Time the block into cso_stage_seconds{stage=...}"""
+    return STAGE_SECONDS.time(stage=stage)
+
+
+def add_metrics_route(server, path='/metrics'):
+    """
+    Serve the registry on a Flask server, e.g. a Dash app's app.server
+    """
+    from flask import Response
+
+    @server.route(path)
+    def metrics():
+        return Response(REGISTRY.exposition(), content_type=CONTENT_TYPE)
+
+    return server
@@ -1,95 +1,751 @@
-def parse_reponse(dimensions, values):
-    dimension_compiled = {}
-    for d in dimensions.keys():
-        # dimension_compiled.append([])
-        # print(dimensions[d]['category']['label'])
-        tmparray = []
-        for lst in dimensions[d]['category']['label'].keys():
-            tmparray.append(dimensions[d]['category']['label'][lst])
-        dimension_compiled[d] = tmparray
-
-    n = 0
-    lst2 = [[""]]
-    while n < len(dimension_compiled):
-        lst2.append([])
-        for d in dimension_compiled[list(dimension_compiled.keys())[n]]:
-            for l in lst2[n]:
-                lst2[n + 1].append(l + "_" + d)
-        n = n + 1
-
-    m = 0
-    data_dict = []
-    for l in lst2[len(lst2) - 1]:
-        tmpd = {}
-        f = l.split("_")
-        r = 1
-        for lbl in list(dimension_compiled.keys()):
-            tmpd[lbl] = f[r]
-            r = r + 1
-        tmpd["value"] = values[m]
-        data_dict.append(tmpd)
-        m = m + 1
-    return data_dict
+import codecs
+import json
+import re
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
+import numpy as np
+import pandas as pd
+import requests
+from cso_cache import CACHE
+from cso_catalog import CATALOG
+from cso_client import CLIENT, CSO_API_BASE
+from metrics import ROWS_DECODED, timed
+
+CSO_API_URL = CSO_API_BASE + "/public/api.restful/PxStat.Data.Cube_API.ReadDataset/{table_id}/JSON-stat/2.0/en"
+CSO_METADATA_URL = CSO_API_BASE + "/public/api.restful/PxStat.Data.Cube_API.ReadMetadata/{table_id}/JSON-stat/2.0/en"
+CSO_JSONRPC_URL = CSO_API_BASE + "/public/api.jsonrpc"
+
+# Number of cells per chunk emitted by the streaming decoder
+DEFAULT_CHUNK_SIZE = 100_000
+# Number of bytes read from the socket at a time when streaming
+READ_SIZE = 1 << 16
+# Number of tables downloaded at once by fetch_cso_tables
+DEFAULT_FETCH_WORKERS = 4
+
+
+def _category_codes(dimension):
+    """
+    Return the category codes of a JSON-stat dimension in cube order
+
+    JSON-stat 2.0 allows category.index to be either a list of codes or a
+    dict mapping code -> position. When it is missing the label order is used.
+    """
+    category = dimension['category']
+    index = category.get('index')
+    if index is None:
+        return list(category['label'].keys())
+    if isinstance(index, dict):
+        return sorted(index, key=index.get)
+    return list(index)
+
+
+def _smallest_int_dtype(n):
+    for dtype in (np.int8, np.int16, np.int32):
+        if n <= np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+def _dimension_layout(dimensions, ids=None, sizes=None):
+    """
+    Work out how cell positions map onto each dimension of a cube
+
+    The cube is stored row-major with the last dimension varying fastest, so
+    the category position of cell p along a dimension is (p // inner) % size,
+    where inner is the product of the sizes of the dimensions after it.
+
+    Returns:
+        (total, layout) where layout is a list of
+        (dimension id, size, inner, category position -> label code, labels)
+    """
+    if ids is None:
+        ids = list(dimensions.keys())
+    if sizes is None:
+        sizes = [len(_category_codes(dimensions[d])) for d in ids]
+
+    total = int(np.prod(sizes, dtype=np.int64))
+    layout = []
+    inner = total
+    for d, size in zip(ids, sizes):
+        inner //= size
+        labels_by_code = dimensions[d]['category'].get('label', {})
+        labels = [labels_by_code.get(code, code) for code in _category_codes(dimensions[d])]
+        # Two codes may share a label; categories have to be unique
+        remap, categories = pd.factorize(pd.Index(labels))
+        remap = remap.astype(_smallest_int_dtype(size))
+        layout.append((d, size, inner, remap, categories))
+    return total, layout
+
+
+def _compact_values(values):
+    """
+    Cell values as a float array: float32 when every value fits it exactly,
+    e.g. counts, float64 otherwise; missing and non-numeric cells are NaN
+    """
+    values = _to_float(values)
+    narrow = values.astype(np.float32)
+    exact = (narrow == values) | np.isnan(values)
+    return narrow if exact.all() else values
+
+
+def _sparse_cells(cells, total):
+    """
+    Cell positions and entries of a sparse JSON-stat 'value' or 'status'
+    object, keyed by the cell's position in the cube as a string
+
+    Returns:
+        (sorted int64 positions, list of entries in the same order)
+    """
+    positions = np.fromiter(map(int, cells.keys()), dtype=np.int64, count=len(cells))
+    entries = list(cells.values())
+    if len(positions) and (positions.min() < 0 or positions.max() >= total):
+        raise ValueError(f"Cell position out of range for a cube of {total} cells")
+    if (np.diff(positions) < 0).any():
+        order = np.argsort(positions, kind='stable')
+        entries = [entries[i] for i in order]
+        positions = positions[order]
+    return positions, entries
+
+
+def _coordinates(layout, positions):
+    """Categorical column per dimension for the cells at positions"""
+    return {d: pd.Categorical.from_codes(remap[(positions // inner) % size], categories=categories)
+            for d, size, inner, remap, categories in layout}
+
+
+def _status_column(status, total, positions):
+    """
+    Status of the cells at positions (all of them if None): JSON-stat allows
+    one string for every cell, a list with one per cell or a sparse object
+    """
+    n = total if positions is None else len(positions)
+    if isinstance(status, str):
+        return pd.Categorical.from_codes(np.zeros(n, dtype=np.int8), categories=[status])
+    if isinstance(status, dict):
+        cells, entries = _sparse_cells(status, total)
+        codes, categories = pd.factorize(pd.Index(entries, dtype=object))
+        full = np.full(n, -1, dtype=_smallest_int_dtype(len(categories)))
+        if positions is None:
+            full[cells] = codes
+        else:
+            found = np.searchsorted(positions, cells)
+            hit = found < n
+            hit[hit] = positions[found[hit]] == cells[hit]
+            full[found[hit]] = codes[hit]
+        return pd.Categorical.from_codes(full, categories=categories)
+    status = list(status)
+    if positions is not None:
+        status = [status[p] for p in positions]
+    return pd.Categorical(status)
+
+
+def parse_reponse(dimensions, values, ids=None, sizes=None, status=None):
+    """
+    Decode a JSON-stat 2.0 cube into a long DataFrame
+
+    The category position of every cell along each dimension is a repeat/tile
+    of an arange. Labels are never concatenated or split, which keeps the
+    work vectorised and lets labels contain any character.
+
+    A sparse 'value' object (cell position -> value) gives one row per cell
+    it lists, with the coordinates worked out from those positions alone,
+    so time and memory go with the populated cells rather than the size of
+    the cube.
+
+    Args:
+        dimensions: The 'dimension' object of the response
+        values: The 'value' array of the response, one entry per cell, or
+            its sparse object form
+        ids: The 'id' array of the response (defaults to the dimension order)
+        sizes: The 'size' array of the response (defaults to category counts)
+        status: The 'status' member of the response, if any: a string, a
+            list or a sparse object
+
+    Returns:
+        pandas DataFrame with one categorical column per dimension (small int
+        codes into the dimension's labels), a float 'value' column, see
+        memory_report, and a categorical 'status' column if status is given
+    """
+    with timed('parse'):
+        total, layout = _dimension_layout(dimensions, ids, sizes)
+        positions = None
+        if isinstance(values, dict):
+            positions, values = _sparse_cells(values, total)
+            columns = _coordinates(layout, positions)
+        else:
+            columns = {}
+            for d, size, inner, remap, categories in layout:
+                outer = total // (size * inner)
+                codes = np.tile(np.repeat(remap, inner), outer)
+                columns[d] = pd.Categorical.from_codes(codes, categories=categories)
+
+    with timed('frame'):
+        columns['value'] = _compact_values(values)
+        if status is not None:
+            columns['status'] = _status_column(status, total, positions)
+        frame = pd.DataFrame(columns, copy=False)
+    ROWS_DECODED.inc(len(frame))
+    return frame
+
+
+def memory_report(frame):
+    """
+    Memory a decoded table takes against the same rows with a Python object
+    per cell, as in a frame built from plain lists or read_csv without dtypes
+
+    Returns:
+        pandas DataFrame indexed by column with the dtype, bytes used, bytes
+        as objects and how many times smaller the column is, plus a 'total' row
+    """
+    rows = []
+    for name, column in frame.items():
+        used = column.memory_usage(index=False, deep=True)
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            # A pointer per row to its own copy of the label
+            sizes = np.array([sys.getsizeof(label) for label in column.cat.categories] + [0])
+            codes = column.cat.codes.to_numpy()
+            naive = 8 * len(column) + int(sizes[codes].sum())
+        else:
+            # A pointer per row to a boxed float
+            naive = (8 + sys.getsizeof(1.0)) * len(column)
+        rows.append({'column': name, 'dtype': str(column.dtype), 'bytes': used, 'object_bytes': naive})
+    report = pd.DataFrame(rows, columns=['column', 'dtype', 'bytes', 'object_bytes']).set_index('column')
+    report.loc['total'] = ['', report['bytes'].sum(), report['object_bytes'].sum()]
+    report['smaller'] = report['object_bytes'] / report['bytes'].clip(lower=1)
+    return report
+
+
+def memory_summary(frames):
+    """One line for the logs on the memory decoded tables take"""
+    used = naive = 0
+    for frame in frames:
+        if not frame.empty:
+            total = memory_report(frame).loc['total']
+            used += total['bytes']
+            naive += total['object_bytes']
+    return (f"Decoded tables: {used / 1e3:,.0f} kB, {naive / 1e3:,.0f} kB as Python objects "
+            f"({naive / max(used, 1):.0f}x smaller)")
+
+
+def _chunk_frame(layout, positions, values):
+    """
+    Decode the cells at positions of a cube into a long DataFrame
+    """
+    with timed('parse'):
+        columns = _coordinates(layout, positions)
+    with timed('frame'):
+        columns['value'] = values
+        frame = pd.DataFrame(columns)
+    ROWS_DECODED.inc(len(frame))
+    return frame
+
+
+_WHITESPACE = re.compile(r'[ \t\r\n]*')
+_DECODER = json.JSONDecoder()
+
+
+class _StreamReader:
+    """
+    Buffered cursor over a stream of text chunks
+
+    Only the unconsumed tail of the stream is kept in memory.
+    """
+
+    def __init__(self, texts):
+        self.texts = texts
+        self.buf = ''
+        self.pos = 0
+
+    def more(self):
+        text = next(self.texts, None)
+        if text is None:
+            return False
+        self.buf = self.buf[self.pos:] + text
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Skip whitespace and return the next character"""
+        while True:
+            self.pos = _WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.more():
+                raise ValueError("Unexpected end of JSON-stat stream")
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"Expected '{char}' at offset {self.pos} of JSON-stat stream")
+        self.pos += 1
+
+    def decode_value(self):
+        """Decode one complete JSON value, reading more of the stream as needed"""
+        self.peek()
+        retry_at = 0
+        exhausted = False
+        while True:
+            # Only retry once the buffer has doubled, so large values decode in linear time
+            if exhausted or len(self.buf) - self.pos >= retry_at:
+                try:
+                    value, end = _DECODER.raw_decode(self.buf, self.pos)
+                except json.JSONDecodeError:
+                    if exhausted:
+                        raise ValueError("Unexpected end of JSON-stat stream")
+                    retry_at = 2 * (len(self.buf) - self.pos)
+                else:
+                    # A number at the very end of the buffer may continue in the next chunk
+                    if end < len(self.buf) or exhausted or not self.more():
+                        self.pos = end
+                        return value
+                    continue
+            if not exhausted and not self.more():
+                exhausted = True
+
+    def iter_array(self):
+        """
+        Yield the elements of the array whose '[' was just consumed, as lists
+
+        Elements must be numbers, null or strings without ',' or ']' in them,
+        which holds for JSON-stat 'value' arrays.
+        """
+        while True:
+            end = self.buf.find(']', self.pos)
+            if end >= 0:
+                segment = self.buf[self.pos:end]
+                self.pos = end + 1
+                if segment.strip():
+                    yield json.loads('[' + segment + ']')
+                return
+            cut = self.buf.rfind(',', self.pos)
+            if cut > self.pos:
+                segment = self.buf[self.pos:cut]
+                self.pos = cut + 1
+                yield json.loads('[' + segment + ']')
+            if not self.more():
+                raise ValueError("Unexpected end of JSON-stat stream")
+
+
+def _iter_text(byte_chunks):
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    for chunk in byte_chunks:
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    text = decoder.decode(b'', final=True)
+    if text:
+        yield text
+
+
+def _to_float(items):
+    try:
+        return np.array(items, dtype=np.float64)
+    except (TypeError, ValueError):
+        return pd.to_numeric(pd.Series(items, dtype=object), errors='coerce').to_numpy(np.float64)
+
+
+def _rechunk(segments, chunk_size):
+    """Regroup lists of cell values into float arrays of exactly chunk_size cells"""
+    pending = []
+    n_pending = 0
+    start = 0
+    for items in segments:
+        block = _to_float(items)
+        pending.append(block)
+        n_pending += len(block)
+        while n_pending >= chunk_size:
+            joined = np.concatenate(pending)
+            yield start, joined[:chunk_size]
+            start += chunk_size
+            pending = [joined[chunk_size:]]
+            n_pending -= chunk_size
+    if n_pending:
+        yield start, np.concatenate(pending)
+
+
+def iter_jsonstat_chunks(byte_chunks, chunk_size=DEFAULT_CHUNK_SIZE, sparse=False):
+    """
+    Incrementally parse a JSON-stat 2.0 document
+
+    Everything except the 'value' array is small and is decoded as a whole.
+    The 'value' array is parsed as it arrives and emitted in fixed-size
+    chunks. If it arrives before 'id', 'size' and 'dimension' it is spilled
+    to a temporary file and replayed once the document is complete, so memory
+    use never depends on the number of cells. A sparse 'value' object only
+    holds the populated cells and is decoded whole, then laid out in chunks.
+
+    Args:
+        byte_chunks: Iterable of bytes, e.g. response.iter_content()
+        chunk_size: Number of cells per emitted chunk
+        sparse: Emit a sparse 'value' object as one chunk of its populated
+            cells, with an int64 array of their positions in place of start
+
+    Yields:
+        (metadata, start, values) where metadata holds every top-level key
+        except 'value' and values is a float array of the cells from start on
+    """
+    reader = _StreamReader(_iter_text(byte_chunks))
+    document = {}
+    spill = yield from _iter_members(reader, document, chunk_size)
+    if 'error' in document:
+        raise ValueError(f"CSO API error: {document['error']}")
+    # JSON-RPC responses wrap the dataset in a result member
+    metadata = document.get('result', document)
+
+    if spill is not None:
+        with spill:
+            spill.seek(0)
+            start = 0
+            while True:
+                values = np.fromfile(spill, dtype=np.float64, count=chunk_size)
+                if not len(values):
+                    break
+                yield metadata, start, values
+                start += len(values)
+    elif isinstance(metadata.get('value'), dict):
+        # Chunks cover every cell from start on, so a sparse value object is
+        # laid out one chunk at a time with NaN for the cells it leaves out
+        total = int(np.prod(metadata['size'], dtype=np.int64))
+        positions, entries = _sparse_cells(metadata.pop('value'), total)
+        entries = _to_float(entries)
+        if sparse:
+            yield metadata, positions, entries
+            return
+        for start in range(0, total, chunk_size):
+            values = np.full(min(chunk_size, total - start), np.nan)
+            lo, hi = np.searchsorted(positions, [start, start + len(values)])
+            values[positions[lo:hi] - start] = entries[lo:hi]
+            yield metadata, start, values
+    elif 'value' in metadata:
+        for start, values in _rechunk([metadata.pop('value')], chunk_size):
+            yield metadata, start, values
+
+
+def _iter_members(reader, metadata, chunk_size):
+    """
+    Parse the members of the JSON object starting at the reader into metadata
+
+    Yields the chunks of a 'value' array that can be mapped to coordinates
+    straight away and returns the spill file of one that could not.
+    """
+    spill = None
+    reader.expect('{')
+    while True:
+        char = reader.peek()
+        if char == '}':
+            reader.pos += 1
+            return spill
+        if char == ',':
+            reader.pos += 1
+            continue
+        key = reader.decode_value()
+        reader.expect(':')
+        if key == 'result' and reader.peek() == '{':
+            metadata['result'] = {}
+            spill = yield from _iter_members(reader, metadata['result'], chunk_size)
+        elif key == 'value' and reader.peek() == '[':
+            reader.pos += 1
+            chunks = _rechunk(reader.iter_array(), chunk_size)
+            if all(k in metadata for k in ('id', 'size', 'dimension')):
+                for start, values in chunks:
+                    yield metadata, start, values
+            else:
+                spill = tempfile.TemporaryFile()
+                for start, values in chunks:
+                    values.tofile(spill)
+        else:
+            metadata[key] = reader.decode_value()
+
+
+def get_cso_metadata(table_id, use_cache=True):
+    """
+    Fetch the dimensions and categories of a CSO table without its values
+
+    Args:
+        table_id: The ID of the table
+        use_cache: Whether to go through the on-disk cache
+
+    Returns:
+        The JSON-stat dataset object, minus 'value'
+    """
+    url = CSO_METADATA_URL.format(table_id=table_id)
+    if use_cache:
+        status_code, payload = CACHE.fetch(f"{table_id}:metadata", None,
+                                           lambda headers: CLIENT.get(url, headers=headers),
+                                           validate=is_dataset_payload)
+    else:
+        response = CLIENT.get(url)
+        status_code, payload = response.status_code, response.content
+    if status_code != 200:
+        raise requests.HTTPError(f"Error fetching metadata for {table_id}: {status_code}")
+    data = json.loads(payload)
+    if 'error' in data:
+        raise ValueError(f"CSO API error: {data['error']}")
+    return data.get('result', data)
+
+
+def _resolve(name, candidates):
+    """Find the code whose code or label matches name, ignoring case"""
+    folded = str(name).casefold()
+    for code, label in candidates.items():
+        if code.casefold() == folded or str(label).casefold() == folded:
+            return code
+    return None
+
+
+def plan_query(table_id, variables, metadata):
+    """
+    Translate a selection into a PxStat JSON-RPC ReadDataset request
+
+    Only the selected categories are requested, so the CSO does the
+    filtering and the response holds just the cells a chart needs.
+    Dimensions that are not mentioned are returned in full.
+
+    Args:
+        table_id: The ID of the table
+        variables: Dictionary of dimension -> categories to keep. Dimensions
+            and categories may be given by code or label, in any case
+        metadata: The table's metadata, from get_cso_metadata
+
+    Returns:
+        The JSON-RPC request as a dictionary
+
+    Raises:
+        ValueError if a dimension or category does not exist in the table
+    """
+    dimensions = metadata['dimension']
+    dimension_labels = {d: dimensions[d].get('label', d) for d in metadata.get('id', dimensions)}
+    selected = {}
+    for name, categories in variables.items():
+        d = _resolve(name, dimension_labels)
+        if d is None:
+            raise ValueError(f"{table_id} has no dimension {name!r}; it has {list(dimension_labels.values())}")
+        labels = dimensions[d]['category'].get('label', {})
+        category_labels = {code: labels.get(code, code) for code in _category_codes(dimensions[d])}
+        if isinstance(categories, (str, int)):
+            categories = [categories]
+        codes = []
+        for category in categories:
+            code = _resolve(category, category_labels)
+            if code is None:
+                raise ValueError(f"{table_id} has no {dimension_labels[d]} {category!r}")
+            codes.append(code)
+        selected[d] = {"category": {"index": codes}}
+
+    return {
+        "jsonrpc": "2.0",
+        "method": "PxStat.Data.Cube_API.ReadDataset",
+        "params": {
+            "class": "query",
+            "id": list(selected),
+            "dimension": selected,
+            "extension": {
+                "pivot": None,
+                "codes": False,
+                "language": {"code": "en"},
+                "format": {"type": "JSON-stat", "version": "2.0"},
+                "matrix": table_id,
+            },
+            "version": "2.0",
+        },
+    }
+
+
+def _request_cso_table(table_id, variables=None, stream=False, headers=None, use_cache=True):
+    # If variables are specified, ask the CSO for just those cells
+    if variables:
+        # Plan from the local catalog when it has the table, saving a metadata request; a
+        # selection naming something newer than the catalog is planned from live metadata
+        metadata = CATALOG.metadata(table_id) if use_cache else None
+        try:
+            query = plan_query(table_id, variables, metadata or get_cso_metadata(table_id, use_cache))
+        except ValueError:
+            if metadata is None:
+                raise
+            query = plan_query(table_id, variables, get_cso_metadata(table_id, use_cache))
+        params = {"data": json.dumps(query)}
+        return CLIENT.get(CSO_JSONRPC_URL, params=params, stream=stream, headers=headers)
+    return CLIENT.get(CSO_API_URL.format(table_id=table_id), stream=stream, headers=headers)
+
+
+def _iter_cso_chunks(table_id, variables, chunk_size, sparse=False):
+    with _request_cso_table(table_id, variables, stream=True) as response:
+        if response.status_code != 200:
+            print(f"Error fetching data: {response.status_code}")
+            return
+        yield from iter_jsonstat_chunks(response.iter_content(READ_SIZE), chunk_size, sparse)
+
+
+def is_dataset_payload(payload):
+    """
+    Whether a 200 response holds data rather than a JSON-RPC error envelope,
+    which PxStat also sends with status 200; only payloads mentioning
+    "error" at all are decoded to check
+    """
+    if b'"error"' not in payload:
+        return True
+    try:
+        data = json.loads(payload)
+    except ValueError:
+        return False
+    return isinstance(data, dict) and 'error' not in data
+
+
+def _download_cso_payload(table_id, variables=None, use_cache=True):
+    if use_cache:
+        return CACHE.fetch(
+            table_id, variables, lambda headers: _request_cso_table(table_id, variables, headers=headers),
+            validate=is_dataset_payload)
+    response = _request_cso_table(table_id, variables, use_cache=False)
+    return response.status_code, response.content
+
+
+def _decode_cso_payload(payload, as_cube=False):
+    with timed('decode'):
+        data = json.loads(payload)
+    if 'error' in data:
+        raise ValueError(f"CSO API error: {data['error']}")
+    # JSON-RPC responses wrap the dataset in a result member
+    data = data.get('result', data)
+    if as_cube:
+        # Imported here as cso_cube builds on this module
+        from cso_cube import Cube
+        with timed('parse'):
+            return Cube.from_jsonstat(data)
+
+    # Process JSON-stat format to pandas DataFrame
+    dimensions = data['dimension']
+    values = data['value']
+
+    frame = parse_reponse(dimensions, values, data.get('id'), data.get('size'), data.get('status'))
+    frame.attrs.update(dataset_attrs(data))
+    return frame
+
+
+def dataset_attrs(data):
+    """
+    Table-level details of a JSON-stat dataset worth keeping with its DataFrame
+    """
+    return {
+        'label': data.get('label'),
+        'updated': data.get('updated'),
+        'dimension_labels': {d: dimension.get('label', d) for d, dimension in data['dimension'].items()},
+    }
 
 
 # Function to fetch data from CSO API
-def get_cso_data(table_id, variables=None):
+def get_cso_data(table_id, variables=None, use_cache=True, as_cube=False):
     """
     Fetch data from CSO PxStat API
-    
+
+    Responses are kept in the on-disk cache (see cso_cache.py) and only
+    downloaded again once the CSO reports that the table has changed.
+
     Args:
         table_id: The ID of the table to fetch
-        variables: Dictionary of variables to filter by
-    
+        variables: Dictionary of dimension -> categories to keep, see plan_query
+        use_cache: Whether to go through the on-disk cache
+        as_cube: Return a cso_cube.Cube, one N-d array with label indexes,
+            rather than a long DataFrame
+
     Returns:
-        pandas DataFrame with the results
+        pandas DataFrame with the results (a Cube if as_cube, None if the
+        request failed)
     """
-    url = f"https://ws.cso.ie/public/api.restful/PxStat.Data.Cube_API.ReadDataset/{table_id}/JSON-stat/2.0/en"
-    
-    # If variables are specified, add them to the request
-    if variables:
-        params = {
-            "query": json.dumps({"request": variables}),
-            "format": "json-stat2"
-        }
-        response = requests.get(url, params=params)
-    else:
-        response = requests.get(url)
-    
-    if response.status_code == 200:
-        data = response.json()
-        
-        # Process JSON-stat format to pandas DataFrame
-        # This part depends on the structure of the response
-        # Example basic processing:
-        dimensions = data['dimension']
-        values = data['value']
-        
-        # Create a DataFrame based on the specific structure
-        # This is a simplified example - you'll need to adapt it
-        results = parse_reponse(dimensions, values)
-
-        
-        # Process based on the specific structure of the dataset
-        # More processing code would go here
-        
-        return pd.DataFrame(results)
+    status_code, payload = _download_cso_payload(table_id, variables, use_cache)
+
+    if status_code == 200:
+        return _decode_cso_payload(payload, as_cube)
     else:
-        print(f"Error fetching data: {response.status_code}")
-        return pd.DataFrame()
+        print(f"Error fetching data: {status_code}")
+        return None if as_cube else pd.DataFrame()
 
-# Function to get potato yield data
-import pandas as pd
 
+def fetch_cso_tables(tables, max_workers=DEFAULT_FETCH_WORKERS, use_cache=True):
+    """
+    Fetch several tables from CSO PxStat API at the same time
+
+    Downloads run on a pool of at most max_workers threads and each payload
+    is handed to a separate decoding pool as soon as it arrives, so the
+    total time is roughly that of the slowest table. A table that fails is
+    reported and comes back as an empty DataFrame without affecting the rest.
+
+    Args:
+        tables: Dictionary of name -> (table_id, variables)
+        max_workers: Maximum number of downloads in flight
+        use_cache: Whether to go through the on-disk cache
+
+    Returns:
+        Dictionary of name -> pandas DataFrame, in the order of tables
+    """
+    frames = {}
+    with ThreadPoolExecutor(max_workers) as downloaders, ThreadPoolExecutor(max_workers) as decoders:
+        downloads = {
+            downloaders.submit(_download_cso_payload, table_id, variables, use_cache): name
+            for name, (table_id, variables) in tables.items()
+        }
+        decodes = {}
+        for future in as_completed(downloads):
+            name = downloads[future]
+            try:
+                status_code, payload = future.result()
+            except Exception as e:
+                status_code, payload = e, None
+            if status_code == 200:
+                decodes[decoders.submit(_decode_cso_payload, payload)] = name
+            else:
+                print(f"Error fetching data for {tables[name][0]}: {status_code}")
+                frames[name] = pd.DataFrame()
+
+        for future in as_completed(decodes):
+            name = decodes[future]
+            try:
+                frames[name] = future.result()
+            except Exception as e:
+                print(f"Error decoding data for {tables[name][0]}: {e}")
+                frames[name] = pd.DataFrame()
+
+    return {name: frames[name] for name in tables}
+
+
+def stream_cso_data(table_id, variables=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Fetch data from CSO PxStat API as a stream of DataFrame chunks
+
+    The response is parsed straight off the socket, so only one chunk of
+    cells is held in memory at a time however large the table is.
+
+    Args:
+        table_id: The ID of the table to fetch
+        variables: Dictionary of dimension -> categories to keep, see plan_query
+        chunk_size: Number of cells per chunk
+
+    Yields:
+        pandas DataFrames with the same columns as get_cso_data; a sparse
+        table only gives rows for its populated cells, like get_cso_data
+    """
+    layout = None
+    for metadata, start, values in _iter_cso_chunks(table_id, variables, chunk_size, sparse=True):
+        if layout is None:
+            _, layout = _dimension_layout(metadata['dimension'], metadata.get('id'), metadata.get('size'))
+        if isinstance(start, np.ndarray):
+            # The populated cells of a sparse table, all at once; split back into chunk_size rows
+            for row in range(0, len(start), chunk_size):
+                yield _chunk_frame(layout, start[row:row + chunk_size], values[row:row + chunk_size])
+        else:
+            yield _chunk_frame(layout, np.arange(start, start + len(values), dtype=np.int64), values)
+
+
+# Function to get potato yield data
 def get_potato_data():
     """
     Get potato yield data from CSO
     For this example, I'm using a sample - replace with actual API call
-    
+
     Table code for crops: AQA04 (Crop Yield and Production)
     """
     # In reality, you would do:
     data = get_cso_data("AQA04")
-    
+
     return data
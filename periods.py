@@ -0,0 +1,168 @@
+import numpy as np
+import pandas as pd
+
+# Periods per year of each CSO time dimension frequency, TLIST(A1), TLIST(Q1) and TLIST(M1)
+PERIODS_PER_YEAR = {'A1': 1, 'Q1': 4, 'M1': 12}
+# pandas Period frequency of each
+PANDAS_FREQUENCIES = {'A1': 'Y', 'Q1': 'Q', 'M1': 'M'}
+# Ways resample can combine the periods that make up a longer one
+RESAMPLE_METHODS = ('sum', 'mean', 'last', 'growth', 'compound')
+
+_MONTHS = {name: n for n, name in enumerate(
+    ['jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec'], start=1)}
+# Codes and labels the CSO uses: 2020, 20201 / 2020Q1, 202001 / 2020M01 / 2020 January
+_PATTERN = r'^(?P<year>\d{4})\s*(?:[QqMm]?\s*(?P<number>\d{1,2})|(?P<month>[A-Za-z]{3})[A-Za-z]*)?$'
+
+
+def time_column(data):
+    """Name of the TLIST(...) column of a table from get_cso_data"""
+    return next(c for c in data.columns if str(c).startswith('TLIST'))
+
+
+def frequency_of(column):
+    """
+    Returns:
+        Frequency of a time dimension id, e.g. 'Q1' for 'TLIST(Q1)'
+
+    Raises:
+        ValueError for frequencies other than annual, quarterly and monthly
+    """
+    frequency = str(column)[len('TLIST('):-1]
+    if not str(column).startswith('TLIST(') or frequency not in PERIODS_PER_YEAR:
+        raise ValueError(f"Unsupported time dimension {column!r}")
+    return frequency
+
+
+def _parse_unique(values, frequency):
+    parts = pd.Series(values, dtype=object).astype(str).str.strip().str.extract(_PATTERN)
+    year = pd.to_numeric(parts['year'])
+    if frequency == 'A1':
+        number = pd.Series(np.where(parts['number'].isna() & parts['month'].isna(), 1, np.nan), index=parts.index)
+    else:
+        number = pd.to_numeric(parts['number']).fillna(parts['month'].str.lower().map(_MONTHS))
+    bad = year.isna() | number.isna() | (number < 1) | (number > PERIODS_PER_YEAR[frequency])
+    if bad.any():
+        raise ValueError(f"{str(values[np.flatnonzero(bad.to_numpy())[0]])!r} isn't a TLIST({frequency}) period")
+    return year.to_numpy(np.int64), number.to_numpy(np.int64)
+
+
+def parse_periods(values, frequency):
+    """
+    Parse CSO time codes or labels into typed periods in one vectorized pass
+
+    Each distinct value is parsed once, so categorical columns from
+    parse_reponse cost as much as their categories.
+
+    Args:
+        values: Codes or labels, e.g. '2020', '20201' or '2020Q1', '202001' or '2020 January'
+        frequency: 'A1', 'Q1' or 'M1'
+
+    Returns:
+        pandas PeriodIndex of the matching frequency
+
+    Raises:
+        ValueError if a value isn't a period of that frequency
+    """
+    if isinstance(values, pd.Series) and isinstance(values.dtype, pd.CategoricalDtype):
+        unique, inverse = values.cat.categories.to_numpy(dtype=object), values.cat.codes.to_numpy()
+        if (inverse < 0).any():
+            raise ValueError("Periods can't be missing")
+    else:
+        unique, inverse = np.unique(np.asarray(values, dtype=object).astype(str), return_inverse=True)
+    year, number = _parse_unique(unique, frequency)
+    # pandas counts periods from the start of 1970 in the frequency's own unit
+    ordinals = (year - 1970) * PERIODS_PER_YEAR[frequency] + number - 1
+    return pd.PeriodIndex.from_ordinals(ordinals[inverse], freq=PANDAS_FREQUENCIES[frequency])
+
+
+def format_periods(periods, frequency):
+    """
+    CSO codes of periods: '2020' for years, '20201' for quarters, '202001' for months
+    """
+    year = pd.Series(periods.year.astype(str))
+    if frequency == 'Q1':
+        return (year + pd.Series(periods.quarter.astype(str))).to_numpy(dtype=object)
+    if frequency == 'M1':
+        return (year + pd.Series(periods.month).map('{:02d}'.format)).to_numpy(dtype=object)
+    return year.to_numpy(dtype=object)
+
+
+def to_annual(data, how='mean'):
+    """
+    Resample a quarterly or monthly table to annual; annual tables are returned as they are
+    """
+    if data.empty or frequency_of(time_column(data)) == 'A1':
+        return data
+    return resample(data, 'A1', how)
+
+
+def resample(data, frequency='A1', how='sum', complete=True):
+    """
+    Bring a CSO table to a longer period, e.g. quarterly or monthly to annual
+
+    Periods are parsed with parse_periods, mapped to the period they fall in
+    and combined per series (every combination of the other dimensions) with
+    one grouped reduction.
+
+    Args:
+        data: Long DataFrame from get_cso_data with one TLIST(...) column and 'value'
+        frequency: Frequency to resample to: 'A1', 'Q1' or 'M1'
+        how: 'sum', 'mean', 'last' (value of the latest period), 'growth'
+            (percentage change of the sum over the previous period) or
+            'compound' (values are percentage changes per period, e.g.
+            quarter-on-quarter growth, compounded over the longer period)
+        complete: Give NaN for periods not every shorter period is there for,
+            rather than e.g. a year's sum over three quarters
+
+    Returns:
+        pandas DataFrame with the other dimensions, TLIST(frequency) as CSO
+        codes and 'value', sorted by series and period
+
+    Raises:
+        ValueError if the frequency is shorter than the table's or how is unknown
+    """
+    if how not in RESAMPLE_METHODS:
+        raise ValueError(f"how must be one of {RESAMPLE_METHODS}, not {how!r}")
+    source_column = time_column(data)
+    source = frequency_of(source_column)
+    ratio, remainder = divmod(PERIODS_PER_YEAR[source], PERIODS_PER_YEAR[frequency])
+    if ratio == 0 or remainder:
+        raise ValueError(f"Can't resample TLIST({source}) to TLIST({frequency})")
+    target_column = f"TLIST({frequency})"
+    others = [c for c in data.columns if c not in (source_column, 'value', 'status')]
+
+    periods = parse_periods(data[source_column], source)
+    target = periods.asfreq(PANDAS_FREQUENCIES[frequency], how='end')
+    frame = pd.DataFrame({c: data[c] for c in others})
+    frame['_period'] = periods.asi8
+    frame['_target'] = target.asi8
+    frame['value'] = data['value'].to_numpy(dtype=np.float64)
+    frame = frame.sort_values('_period', kind='stable')
+
+    values = frame['value']
+    if how == 'compound':
+        values = np.log1p(values / 100)
+    grouped = values.groupby([frame[c] for c in others] + [frame['_target']], observed=True, sort=True)
+    if how == 'mean':
+        result = grouped.mean()
+    elif how == 'last':
+        result = grouped.last()
+    elif how == 'compound':
+        result = np.expm1(grouped.sum(min_count=1)) * 100
+    else:
+        result = grouped.sum(min_count=1)
+    if complete:
+        result = result.where(grouped.count() == ratio)
+    result = result.reset_index()
+
+    if how == 'growth':
+        # Change over the previous period of the same series, only where that period is there
+        series = result[others] if others else pd.DataFrame(index=result.index)
+        same = (series == series.shift()).all(axis=1) & (result['_target'].diff() == 1)
+        previous = result['value'].shift().where(same)
+        result['value'] = (result['value'] / previous - 1) * 100
+
+    result.insert(len(others), target_column,
+                  format_periods(pd.PeriodIndex.from_ordinals(result.pop('_target'),
+                                                              freq=PANDAS_FREQUENCIES[frequency]), frequency))
+    return result
@@ -0,0 +1,345 @@
+import argparse
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+import urllib.parse
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+import cso_catalog
+import parse_response
+from cso_client import CLIENT
+
+RESTFUL_PATH = "/public/api.restful/PxStat.Data.Cube_API.{method}/{table_id}/JSON-stat/2.0/en"
+JSONRPC_PATH = "/public/api.jsonrpc"
+# Port used when run as a script; next to Dash's 8050
+DEFAULT_PORT = 8051
+
+
+def synthetic_cube(table_id, sizes, seed=0, first_year=1990):
+    """
+    Make a JSON-stat 2.0 dataset of random values shaped like a CSO table
+
+    The first dimension is STATISTIC, the second the annual time dimension
+    TLIST(A1) and the rest classifications C01, C02, ...
+
+    Args:
+        table_id: Table id reported in the dataset's extension
+        sizes: Number of categories of each dimension; at least two dimensions
+        seed: Seed for the values
+        first_year: First year of the time dimension
+    """
+    dimensions, ids = {}, []
+    for n, size in enumerate(sizes):
+        if n == 0:
+            d, label, codes = 'STATISTIC', 'Statistic', [f"{table_id}S{i}" for i in range(size)]
+            labels = [f"Statistic {i}" for i in range(size)]
+        elif n == 1:
+            d, label = 'TLIST(A1)', 'Year'
+            codes = labels = [str(first_year + i) for i in range(size)]
+        else:
+            d, label, codes = f"C{n - 1:02d}", f"Classification {n - 1}", [f"{i:02d}" for i in range(size)]
+            labels = [f"{label} category {i}" for i in range(size)]
+        ids.append(d)
+        dimensions[d] = {'label': label, 'category': {'index': codes, 'label': dict(zip(codes, labels))}}
+
+    values = np.random.default_rng(seed).normal(100, 15, int(np.prod(sizes))).round(1)
+    return {
+        'class': 'dataset',
+        'label': f"Synthetic table {table_id}",
+        'updated': '2024-01-01T00:00:00Z',
+        'id': ids,
+        'size': list(sizes),
+        'role': {'time': ['TLIST(A1)']},
+        'dimension': dimensions,
+        'extension': {'matrix': table_id},
+        'value': values.tolist(),
+    }
+
+
+def select_cube(cube, selection):
+    """
+    Cut a dataset down to the selected categories, as a JSON-RPC ReadDataset does
+
+    Args:
+        cube: JSON-stat dataset
+        selection: Dictionary of dimension id -> category codes to keep
+
+    Raises:
+        KeyError if a dimension or category isn't in the cube
+    """
+    values = np.asarray(cube['value'], dtype=object).reshape(cube['size'])
+    positions, dimensions = [], {}
+    for d in cube['id']:
+        dimension = cube['dimension'][d]
+        codes = parse_response._category_codes(dimension)
+        keep = selection.get(d, codes)
+        position = {code: i for i, code in enumerate(codes)}
+        positions.append([position[code] for code in keep])
+        labels = dimension['category'].get('label', {})
+        dimensions[d] = dict(dimension, category={'index': list(keep), 'label': {c: labels.get(c, c) for c in keep}})
+    for d in selection:
+        if d not in cube['dimension']:
+            raise KeyError(d)
+
+    selected = values[np.ix_(*positions)]
+    return dict(cube, dimension=dimensions, size=list(selected.shape), value=selected.ravel().tolist())
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        pxstat = self.server.pxstat
+        fault, delay = pxstat._plan_request()
+        time.sleep(delay)
+        if fault == 'drop':
+            # Hang up without answering, as an overloaded upstream sometimes does
+            self.close_connection = True
+            return
+        if fault is not None:
+            status, body, headers = fault, json.dumps({'error': f"Injected {fault}"}).encode(), {}
+            if fault in (429, 503) and pxstat.retry_after is not None:
+                headers['Retry-After'] = str(pxstat.retry_after)
+        else:
+            status, body = pxstat.respond(self.path)
+            headers = {}
+            if status == 200:
+                etag = '"' + hashlib.sha1(body).hexdigest()[:16] + '"'
+                headers['ETag'] = etag
+                if self.headers.get('If-None-Match') == etag:
+                    status, body = 304, b''
+
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        if status != 304:
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        pxstat._send(self.wfile, body)
+
+
+class PxStatServer:
+    """
+    Local stand-in for the CSO PxStat API
+
+    Serves the RESTful ReadDataset and ReadMetadata endpoints, the JSON-RPC
+    ReadDataset query sent by get_cso_data when variables are given, and
+    ReadCollection, from cubes held in memory: synthetic ones from
+    synthetic_cube or ones recorded from the CSO with record_fixtures.
+    Responses carry an ETag and honour If-None-Match.
+
+    Latency, bandwidth and failures can be injected to test clients against
+    a slow or unreliable upstream. Counts of what was served are kept in stats.
+
+    Args:
+        cubes: Dictionary of table id -> JSON-stat dataset
+        latency: Seconds added before every response
+        jitter: Up to this many more seconds, uniformly at random
+        bandwidth: Bytes per second responses are sent at; unlimited if None
+        error_rate: Fraction of requests answered with one of error_statuses
+        error_statuses: Statuses injected errors are picked from
+        drop_rate: Fraction of requests whose connection is closed without an answer
+        retry_after: Retry-After seconds sent with injected 429 and 503s, or None
+        seed: Seed for the injected latency and failures
+        port: Port to listen on; a free one by default
+    """
+
+    def __init__(self, cubes, latency=0.0, jitter=0.0, bandwidth=None, error_rate=0.0,
+                 error_statuses=(500, 502, 503, 429), drop_rate=0.0, retry_after=0, seed=None, port=0):
+        self.cubes = dict(cubes)
+        self.latency = latency
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.error_statuses = tuple(error_statuses)
+        self.drop_rate = drop_rate
+        self.retry_after = retry_after
+        self.port = port
+        self.stats = {'requests': 0, 'errors': 0, 'dropped': 0, 'bytes': 0}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._encoded = {}
+        self._httpd = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._httpd = ThreadingHTTPServer(('127.0.0.1', self.port), _Handler)
+        self._httpd.daemon_threads = True
+        self._httpd.pxstat = self
+        threading.Thread(target=self._httpd.serve_forever, name='pxstat-server', daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+
+    def _plan_request(self):
+        """
+        Returns:
+            (fault, delay) where fault is None, 'drop' or an error status to
+            send and delay is the seconds to wait before answering
+        """
+        with self._lock:
+            self.stats['requests'] += 1
+            delay = self.latency + self._random.uniform(0, self.jitter)
+            roll = self._random.random()
+            if roll < self.drop_rate:
+                self.stats['dropped'] += 1
+                return 'drop', delay
+            if roll < self.drop_rate + self.error_rate:
+                self.stats['errors'] += 1
+                return self._random.choice(self.error_statuses), delay
+            return None, delay
+
+    def _send(self, wfile, body, chunk_size=16 * 1024):
+        with self._lock:
+            self.stats['bytes'] += len(body)
+        if self.bandwidth is None:
+            wfile.write(body)
+        else:
+            for start in range(0, len(body), chunk_size):
+                chunk = body[start:start + chunk_size]
+                wfile.write(chunk)
+                time.sleep(len(chunk) / self.bandwidth)
+
+    def _encode(self, table_id, metadata_only):
+        key = (table_id, metadata_only)
+        if key not in self._encoded:
+            cube = self.cubes[table_id]
+            if metadata_only:
+                cube = {k: v for k, v in cube.items() if k != 'value'}
+            self._encoded[key] = json.dumps(cube).encode()
+        return self._encoded[key]
+
+    def respond(self, path):
+        """
+        Returns:
+            (HTTP status, body bytes) for a request path
+        """
+        url = urllib.parse.urlparse(path)
+        if url.path == JSONRPC_PATH:
+            query = json.loads(urllib.parse.parse_qs(url.query)['data'][0])
+            params = query['params']
+            table_id = params['extension']['matrix']
+            selection = {d: params['dimension'][d]['category']['index'] for d in params.get('id', [])}
+            try:
+                result = select_cube(self.cubes[table_id], selection)
+            except KeyError as e:
+                error = {'code': -32602, 'message': f"Invalid query: {e}"}
+                return 200, json.dumps({'jsonrpc': '2.0', 'id': query.get('id'), 'error': error}).encode()
+            return 200, json.dumps({'jsonrpc': '2.0', 'id': query.get('id'), 'result': result}).encode()
+
+        parts = url.path.split('/')
+        method = parts[3] if len(parts) > 3 else ''
+        if method.endswith('ReadCollection'):
+            items = [{k: v for k, v in cube.items() if k != 'value'} for cube in self.cubes.values()]
+            return 200, json.dumps({'class': 'collection', 'link': {'item': items}}).encode()
+        table_id = parts[4] if len(parts) > 4 else None
+        if table_id not in self.cubes:
+            return 404, b'{"error": "table not found"}'
+        return 200, self._encode(table_id, method.endswith('ReadMetadata'))
+
+    @contextmanager
+    def use(self):
+        """Point parse_response and cso_catalog at this server while the block runs"""
+        saved = (parse_response.CSO_API_URL, parse_response.CSO_METADATA_URL, parse_response.CSO_JSONRPC_URL,
+                 cso_catalog.CSO_COLLECTION_URL)
+        parse_response.CSO_API_URL = self.url + RESTFUL_PATH.format(method='ReadDataset', table_id='{table_id}')
+        parse_response.CSO_METADATA_URL = self.url + RESTFUL_PATH.format(method='ReadMetadata', table_id='{table_id}')
+        parse_response.CSO_JSONRPC_URL = self.url + JSONRPC_PATH
+        cso_catalog.CSO_COLLECTION_URL = self.url + "/public/api.restful/PxStat.Data.Cube_API.ReadCollection"
+        try:
+            yield self
+        finally:
+            (parse_response.CSO_API_URL, parse_response.CSO_METADATA_URL, parse_response.CSO_JSONRPC_URL,
+             cso_catalog.CSO_COLLECTION_URL) = saved
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def record_fixtures(table_ids, directory):
+    """
+    Download tables from the CSO and save them as fixtures for load_fixtures
+
+    Returns:
+        List of the files written
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for table_id in table_ids:
+        response = CLIENT.get(parse_response.CSO_API_URL.format(table_id=table_id))
+        response.raise_for_status()
+        cube = response.json()
+        cube.setdefault('extension', {}).setdefault('matrix', table_id)
+        path = os.path.join(directory, f"{table_id}.json")
+        with open(path, 'w') as f:
+            json.dump(cube, f)
+        paths.append(path)
+    return paths
+
+
+def load_fixtures(directory):
+    """
+    Returns:
+        Dictionary of table id -> dataset for every <table id>.json in directory
+    """
+    cubes = {}
+    for name in sorted(os.listdir(directory)):
+        if name.endswith('.json'):
+            with open(os.path.join(directory, name)) as f:
+                cubes[name[:-len('.json')]] = json.load(f)
+    return cubes
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Serve CSO tables locally; point the dashboards at it with CSO_API_BASE=http://127.0.0.1:PORT")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--fixtures', help="directory of recorded <table id>.json files to serve")
+    parser.add_argument('--record', nargs='+', metavar='TABLE', help="record these tables into --fixtures first")
+    parser.add_argument('--cube', action='append', default=[], metavar='ID=SIZES',
+                        help="serve a synthetic cube, e.g. SYN1=4,35,30,25; may be repeated")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds before each response")
+    parser.add_argument('--jitter', type=float, default=0.0, help="up to this many more seconds")
+    parser.add_argument('--bandwidth', type=float, default=None, help="bytes per second")
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--drop-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    cubes = {}
+    if args.fixtures:
+        if args.record:
+            record_fixtures(args.record, args.fixtures)
+        cubes.update(load_fixtures(args.fixtures))
+    for n, spec in enumerate(args.cube):
+        table_id, sizes = spec.split('=')
+        cubes[table_id] = synthetic_cube(table_id, [int(size) for size in sizes.split(',')], seed=n)
+
+    server = PxStatServer(cubes, latency=args.latency, jitter=args.jitter, bandwidth=args.bandwidth,
+                          error_rate=args.error_rate, drop_rate=args.drop_rate, seed=args.seed, port=args.port)
+    server.start()
+    print(f"Serving {', '.join(cubes) or 'no tables'} at {server.url}")
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        server.stop()
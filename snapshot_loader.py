@@ -0,0 +1,68 @@
+import threading
+import time
+
+# Seconds between background refreshes of the dashboard data
+DEFAULT_REFRESH_INTERVAL = 60 * 60
+
+
+class SnapshotLoader:
+    """
+    Keeps the latest snapshot of a dataset and refreshes it in the background
+
+    Readers always get the last good snapshot straight away, or None before
+    the first load finishes, and never wait on the network
+    (stale-while-revalidate). A daemon thread first loads the cheap cached
+    snapshot, then the full one, then reloads every refresh_interval seconds.
+    A failed load is reported and the previous snapshot is kept.
+    """
+
+    def __init__(self, load, load_cached=None, refresh_interval=DEFAULT_REFRESH_INTERVAL):
+        self.load = load
+        self.load_cached = load_cached
+        self.refresh_interval = refresh_interval
+        self.version = 0
+        self.loaded_at = None
+        self.error = None
+        self._data = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='snapshot-loader', daemon=True)
+            self._thread.start()
+        return self
+
+    def refresh(self):
+        """Ask the background thread to reload now"""
+        self._wake.set()
+
+    def get(self):
+        """
+        Returns:
+            (snapshot or None, version); the version goes up by one on every new snapshot
+        """
+        with self._lock:
+            return self._data, self.version
+
+    def _run(self):
+        if self.load_cached is not None:
+            self._try(self.load_cached)
+        while True:
+            self._try(self.load)
+            self._wake.wait(self.refresh_interval)
+            self._wake.clear()
+
+    def _try(self, load):
+        try:
+            data = load()
+        except Exception as e:
+            print(f"Error refreshing data: {e}")
+            self.error = e
+            return
+        with self._lock:
+            self._data = data
+            self.version += 1
+            self.loaded_at = time.time()
+            self.error = None